@@ -0,0 +1,71 @@
+"""
+Benchmark of the CCM89 extinction of SplusExtinction.get_extinction (splusdata.features.extinction).
+
+Compares `ccm89_extinction` (one outer product) with the original loop calling
+`extinction.ccm89` once per object, fails if they differ, and times the vectorized path on
+larger catalogs.
+
+    python benchmarks/bench_extinction.py [--rows 100000] [--large 1000000 10000000] [--rtol 1e-6]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extinction
+
+from splusdata.features.extinction import ccm89_extinction
+
+# Default S-PLUS bands of SplusExtinction
+WAVELENGTHS = [3536, 3770, 3940, 4094, 4292, 4751, 5133, 6258, 6614, 7690, 8611, 8831]
+
+
+def legacy(av, wavelengths):
+    lambdas = np.array(wavelengths).astype(float)
+    return np.array([extinction.ccm89(lambdas, av[i], 3.1) for i in range(len(av))])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="catalog size checked against the loop")
+    parser.add_argument("--large", type=int, nargs="*", default=[1000000, 10000000], help="catalog sizes timed with the vectorized path only")
+    parser.add_argument("--rtol", type=float, default=1e-6, help="tolerance of the float32 result")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    av = 3.1 * rng.exponential(0.05, args.rows)
+
+    start = time.perf_counter()
+    expected = legacy(av, WAVELENGTHS)
+    loop_time = time.perf_counter() - start
+
+    failed = False
+    for dtype in (np.float64, np.float32):
+        start = time.perf_counter()
+        result = ccm89_extinction(av, WAVELENGTHS, dtype=dtype)
+        elapsed = time.perf_counter() - start
+
+        error = np.abs(result - expected).max() / np.abs(expected).max()
+        rtol = 0 if dtype is np.float64 else args.rtol
+        ok = result.shape == expected.shape and result.dtype == dtype and error <= rtol
+        failed |= not ok
+        print(f"{args.rows} rows {np.dtype(dtype).name}: loop {loop_time:7.3f} s, vectorized {elapsed:7.4f} s, "
+              f"speedup {loop_time / elapsed:8.0f}x, max relative difference {error:.2e} {'OK' if ok else 'FAILED'}")
+
+    for rows in args.large:
+        av = 3.1 * rng.exponential(0.05, rows)
+        start = time.perf_counter()
+        ccm89_extinction(av, WAVELENGTHS)
+        elapsed = time.perf_counter() - start
+        print(f"{rows} rows float32: vectorized {elapsed:7.3f} s")
+
+    if failed:
+        sys.exit("ccm89_extinction differs from the per row extinction.ccm89 loop")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""
+Equivalence check and timing of the Butterworth filter (splusdata.features.filterbw).
+
+Compares `filter_bw` (in float64, and in the default float32) with the original loop
+implementation (`legacy`) on random images, fails if they differ, and reports the
+time of both. Also times batches of same sized stamps, which reuse the cached kernel, one
+by one and with `filter_bw_batch`, and checks the tiled `filter_bw_tiled` against `filter_bw`.
+
+    python benchmarks/bench_filterbw.py [--sizes 32 64 128] [--large 2048] [--rtol 1e-9] [--stamps 200] [--n-jobs 4] [--tiled 3000]
+"""
+import argparse
+import functools
+import math
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from astropy.io import fits
+from scipy import fft, interpolate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from splusdata.features.filterbw import filter_bw, filter_bw_batch, filter_bw_tiled
+
+
+# Original loop implementation of filter_bw, the reference of the equivalence check
+def legacy(hdu):
+    #frequencia de corte da filtragem a ser utilizada. Para os dados do SPLUS 0.5 é um valor ótimo.
+    cutoff_frequency_x=0.5
+    cutoff_frequency_y=0.5
+
+    #ordem da filtragem, para os dados do SPLUS a melhor ordem é 1. Se usar 2, começam a surgir anéis.
+    order=1.0
+
+    #formato do filtro, não mudar. Para SPLUS elipse2= yes
+    elipse='no'
+    elipse2='yes'
+    elipsevssquare='no'
+
+    #tamanho dos pixels
+    CDELT1=0.55
+    CDELT2=0.55
+
+    try:
+        data=hdu[0].data
+        if data == None:
+            data=hdu[1].data
+    except:
+        data=hdu[1].data
+    
+    #y-eixo vertical da imagem
+    #-eixo horizontal da imagem
+
+    y,x =data.shape
+
+
+    #imagem zerada com tamanho maior do que o original, ela recebe a informação da imagem original
+    imagemzero=np.zeros((y+6,x+6))
+
+    for i in range(0,x):
+        for j in range(0,y):
+            imagemzero[3+j,3+i]=data[j,i]
+
+    #replicação da informação da imagem nas bordas(borda esquerda do cubo)
+
+    for i in range(0,3):
+        for j in range(0,y):
+            imagemzero[3+j,i]=data[j,0]
+
+    #replicação da informação da imagem nas bordas(borda direita do cubo)
+
+    for i in range(0,3):
+        for j in range(0,y):
+            imagemzero[3+j,3+x+i]=data[j,x-1]
+
+    #replicação da  informação da imagem nas bordas(borda de baixo do cubo)
+
+    for i in range(0,x):
+        for j in range(0,3):
+            imagemzero[j,3+i]=data[0,i]
+
+    #replicação da  informação da imagem nas bordas(borda de cima do cubo)
+
+    for i in range(0,x):
+        for j in range(0,3):
+            imagemzero[3+y+j,3+i]= data[y-1,i]
+
+    #sobrou os 4 cantos da imagem com zeros, precisamos preenche-los.
+
+    #canto inferior esquerdo
+    for i in range(0,3):
+        for j in range(0,3):
+            imagemzero[j,i]=imagemzero[j,3]
+
+    #canto inferior direito
+    for i in range(0,3):
+        for j in range(0,3):
+            imagemzero[j,3+i+x]=imagemzero[j,3+x-1]
+
+    #canto superior esquerdo
+    for i in range (0,3):
+        for j in range(0,3):
+            imagemzero[3+y+j,i]=imagemzero[3+y+j,3]
+
+    #canto superior direito
+    for i in range(0,3):
+        for j in range(0,3):
+            imagemzero[3+y+j,3+x+i]=imagemzero[3+y+j,3+x-1]
+
+    y1,x1=imagemzero.shape
+
+    #cria uma imagem maior com bordas zeradas mas com a imagemzero no meio (segunda ampliação do cubo)
+    imagemfinalexpandida=np.zeros((y1+30,x1+30))
+    imagemfinalexpandida[15:y1+15,15:x1+15]=imagemzero
+
+    interpol_values=np.zeros((2,2))
+    interpol_values1=np.zeros((2,2))
+    interpol_values2=np.zeros((2,2))
+    interpol_values3=np.zeros((2,2))
+
+    temporary_column=np.zeros((y1+2,2))
+    temporary_column[y1+1,0]=y1+30
+    temporary_column[1:y1+1,0]=range(15,y1+15)
+
+    #as bordas desta imagem devem ter valores caindo para zero.
+
+    interpol_values[1,0]=15
+    for i in range(15,x1+30):
+        interpol_values[1,1]=imagemfinalexpandida[15,i]
+        interpolate_function=interpolate.interp1d(interpol_values[0:2,0],interpol_values[0:2,1], kind='linear')
+        imagemfinalexpandida[0:16,i]=interpolate_function(np.arange(16))
+
+    interpol_values1[0,0]=y1+15-1
+    interpol_values1[1,0]=y1+30
+    interpol_values1[1,1]=0.0
+    for i in range(15,x1+30):
+        interpol_values1[0,1]=imagemfinalexpandida[y1+15-1,i]
+        interpolate_function1=interpolate.interp1d(interpol_values1[0:2,0],interpol_values1[0:2,1], kind='linear')
+        imagemfinalexpandida[y1+15-1:y1+30,i]=interpolate_function1(y1+15-1+np.arange(16))
+
+    interpol_values2[0,0]=0.0
+    interpol_values2[1,0]=15
+    interpol_values2[0,1]=0.0
+    for j in range(0,y1+30):
+        interpol_values2[1,1]=imagemfinalexpandida[j,15]
+        interpolate_function2=interpolate.interp1d(interpol_values2[0:2,0],interpol_values2[0:2,1], kind='linear')
+        imagemfinalexpandida[j,0:16]=interpolate_function2(np.arange(16))
+
+    interpol_values3[0,0]=x1+15-1
+    interpol_values3[1,0]=x1+30
+    interpol_values3[1,1]=0.0
+    for j in range(0, y1+30):
+        interpol_values3[0,1]=imagemfinalexpandida[j,x1+15-1]
+        interpolate_function3=interpolate.interp1d(interpol_values3[0:2,0],interpol_values3[0:2,1], kind='linear')
+        imagemfinalexpandida[j,x1+15-1:x1+30]=interpolate_function3(x1+15-1+np.arange(16))
+
+    yf,xf= imagemfinalexpandida.shape
+
+    #criar o filtro com o dobro do tamanho do imagemfinalexpandida (que vai ser o tamanho da transformada de fourier)
+    filtro=np.zeros((2*yf,2*xf))
+
+    aa=cutoff_frequency_x*xf
+    bb=cutoff_frequency_y*yf
+    cc=cutoff_frequency_x*xf
+    dd=cutoff_frequency_y*yf
+
+    exporder=2.0*order
+
+    imfilter1=filtro
+    xm=xf
+    ym=yf
+
+    for i in range(0,2*xf):
+        for j in range(0,2*yf):
+            conta= math.sqrt(((i-xm)/aa)**2+((j-ym)/bb)**2)
+            imfilter1[j,i]=1.0/(1.0+conta**exporder)
+
+    imfilter2=filtro
+    for i in range(0,2*xf):
+        for j in range(0,2*yf):
+            conta1=abs(i-xm)/cc
+            conta2=abs(j-ym)/dd
+            imfilter2[j,i]=(1.0/(1.0+conta1**exporder))*(1.0/(1.0+conta2**exporder))
+
+    #define o filtro final (baseando-se no seu formato)        
+    if elipse == 'yes':
+        filtro=imfilter1
+    elif elipse2 == 'yes':
+        filtro=imfilter1*imfilter1
+    elif elipsevssquare == 'yes':
+        filtro=imfilter1*imfilter2
+
+    #imagem que vai receber a filtragem
+    imagemsaida=imagemfinalexpandida
+    npadd=np.zeros((2*yf,2*xf))
+
+
+    #faz a filtragem
+
+    imagein=imagemfinalexpandida[0:yf,0:xf]
+    imageflag=npadd
+        #padding - procedimento de multiplicar certos pixels da imagem por -1, para que a transformada de Fourier fique com
+        #frequência = 0 no centro.
+        #faz o  padding para cada imagem
+    for i in range(0,2*xf):
+        for j in range(0,2*yf):
+            if (i<=xf-1) and (j > yf-1):
+                if((i+j)%2) != 0:
+                    flag=1
+                else:
+                    flag=-1
+                imageflag[j,i]=flag*imagein[j-yf,i]
+            else:
+                imageflag[j,i]=0.0
+
+    #faz a transformada de fourier
+    twodfft=fft.fft2(imageflag)
+    #multiplica pelo filtro
+    filtragem=twodfft*filtro
+    #faz a transformada de fourier inversa
+    twodifft=fft.ifft2(filtragem)
+    invfft=np.real(twodifft)
+    paddout=npadd
+    imageout=imagein
+
+    #remove o padding
+    for i in range(0,2*xf):
+        for j in range(0,2*yf):
+            if((i+j)%2) != 0:
+                flag=1
+            else:
+                flag=-1
+            paddout[j,i]=flag*invfft[j,i]
+            if (i<=xf-1) and (j >yf-1):
+                imageout[j-yf,i]=paddout[j,i]
+    imagemsaida[0:yf,0:xf]=imageout
+
+
+    #cria a imagem final, cortando a imagem filtrada (tirando as bordas)
+    imagemsaida_final=np.zeros((y,x))
+    imagemsaida_final=imagemsaida[18:yf-18,18:xf-18]
+
+    #header
+    header=hdu[0].header
+    new_hdu = fits.PrimaryHDU()
+    new_hdu.header=header
+    image_hdu = fits.ImageHDU(imagemsaida_final)
+    new_hdu.header.set('SIMPLE','T')
+    new_hdu.header.set('CDELT1',0.55)
+    new_hdu.header.set('CDELT2',0.55)
+    new_hdu.verify('fix')
+    hdul = fits.HDUList([new_hdu, image_hdu])
+    
+    return hdul
+
+
+def make_hdul(shape, seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.normal(100, 10, shape)
+    # a few bright point sources, so the filter has something to smooth
+    ys = rng.integers(0, shape[0], 10)
+    xs = rng.integers(0, shape[1], 10)
+    data[ys, xs] += 5000
+    return fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data)])
+
+
+def timed(function, hdul):
+    start = time.perf_counter()
+    result = function(hdul)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[32, 64, 97, 128], help="image sides checked against the legacy code")
+    parser.add_argument("--large", type=int, nargs="*", default=[2048], help="image sides timed with the new code only")
+    parser.add_argument("--rtol", type=float, default=1e-9, help="tolerance of the float64 engine")
+    parser.add_argument("--rtol32", type=float, default=1e-5, help="tolerance of the float32 engine")
+    parser.add_argument("--stamps", type=int, default=200, help="number of 256x256 stamps filtered in a row")
+    parser.add_argument("--workers", type=int, default=None, help="scipy.fft workers")
+    parser.add_argument("--n-jobs", type=int, default=os.cpu_count(), help="processes of filter_bw_batch, threads of filter_bw_tiled")
+    parser.add_argument("--tiled", type=int, nargs="*", default=[3000], help="image sides filtered by filter_bw_tiled")
+    parser.add_argument("--rtol-tiled", type=float, default=1e-5, help="tolerance of filter_bw_tiled, relative to the image peak")
+    args = parser.parse_args()
+
+    filter64 = functools.partial(filter_bw, dtype=np.float64, workers=args.workers)
+    filter32 = functools.partial(filter_bw, workers=args.workers)
+
+    failed = False
+    for size in args.sizes:
+        shape = (size, size + 7)
+        old, old_time = timed(legacy, make_hdul(shape))
+        b = old[1].data
+        scale = np.abs(b).max()
+
+        for name, function, rtol in (("float64", filter64, args.rtol), ("float32", filter32, args.rtol32)):
+            new, new_time = timed(function, make_hdul(shape))
+            a = new[1].data
+            error = np.abs(a - b).max() / scale
+            ok = a.shape == b.shape and error <= rtol and new[0].header["CDELT1"] == old[0].header["CDELT1"]
+            failed |= not ok
+            print(f"{shape} {name}: legacy {old_time:8.3f} s, vectorized {new_time:7.3f} s, "
+                  f"speedup {old_time / new_time:7.1f}x, max relative difference {error:.2e} {'OK' if ok else 'FAILED'}")
+
+    for size in args.large:
+        for name, function in (("float64", filter64), ("float32", filter32)):
+            _, new_time = timed(function, make_hdul((size, size)))
+            print(f"({size}, {size}) {name}: vectorized {new_time:7.3f} s")
+
+    if args.stamps:
+        stamps = [make_hdul((256, 256), seed) for seed in range(args.stamps)]
+        start = time.perf_counter()
+        for hdul in stamps:
+            filter32(hdul)
+        elapsed = time.perf_counter() - start
+        print(f"{args.stamps} stamps (256, 256) float32: {elapsed:.3f} s, {1000 * elapsed / args.stamps:.2f} ms each")
+
+        for n_jobs in sorted({1, args.n_jobs}):
+            start = time.perf_counter()
+            cube, headers = filter_bw_batch(stamps, n_jobs=n_jobs, workers=args.workers)
+            elapsed = time.perf_counter() - start
+            print(f"{args.stamps} stamps (256, 256) float32, filter_bw_batch n_jobs={n_jobs}: {elapsed:.3f} s, "
+                  f"{1000 * elapsed / args.stamps:.2f} ms each")
+
+    for size in args.tiled:
+        hdul = make_hdul((size, size + 100))
+        reference, full_time = timed(filter32, hdul)
+        with tempfile.TemporaryDirectory() as folder:
+            start = time.perf_counter()
+            path = filter_bw_tiled(hdul, os.path.join(folder, "tiled.fits"), tile_size=1024, n_jobs=args.n_jobs)
+            tiled_time = time.perf_counter() - start
+            with fits.open(path) as tiled:
+                b = reference[1].data
+                error = np.abs(tiled[1].data - b).max() / np.abs(b).max()
+        ok = error <= args.rtol_tiled
+        failed |= not ok
+        print(f"({size}, {size + 100}) filter_bw {full_time:7.3f} s, filter_bw_tiled {tiled_time:7.3f} s, "
+              f"max difference {error:.2e} of the peak {'OK' if ok else 'FAILED'}")
+
+    if failed:
+        sys.exit("filter_bw differs from the legacy implementation")
+
+
+if __name__ == "__main__":
+    main()
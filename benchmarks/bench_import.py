@@ -0,0 +1,66 @@
+"""
+Import time benchmark of the splusdata package.
+
+Runs `import splusdata; splusdata.Core` in fresh interpreters, reports the best wall time
+and fails if one of the heavy optional dependencies got imported on the way.
+
+    python benchmarks/bench_import.py [--repeat 5] [--max-seconds 0.5]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# Modules `import splusdata; splusdata.Core` must not load.
+HEAVY_MODULES = ["astropy", "scipy", "PIL", "pandas", "numpy", "astroquery", "dustmaps", "extinction", "yaml"]
+
+SNIPPET = """
+import sys, time
+start = time.perf_counter()
+import splusdata
+splusdata.Core
+elapsed = time.perf_counter() - start
+heavy = sorted(m for m in {heavy!r} if m in sys.modules)
+print(elapsed)
+print(",".join(heavy))
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_once():
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    out = subprocess.run(
+        [sys.executable, "-c", SNIPPET.format(heavy=HEAVY_MODULES)],
+        capture_output=True, text=True, check=True, env=env,
+    ).stdout.splitlines()
+    return float(out[0]), [m for m in out[1].split(",") if m]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=None, help="fail if the best import time is above this")
+    args = parser.parse_args()
+
+    times = []
+    heavy = []
+    for _ in range(args.repeat):
+        elapsed, heavy = run_once()
+        times.append(elapsed)
+
+    best = min(times)
+    print(f"import splusdata; splusdata.Core: best {best * 1000:.1f} ms, median {sorted(times)[len(times) // 2] * 1000:.1f} ms over {args.repeat} runs")
+
+    failed = False
+    if heavy:
+        print("FAIL: heavy modules imported:", ", ".join(heavy))
+        failed = True
+    if args.max_seconds is not None and best > args.max_seconds:
+        print(f"FAIL: import took more than {args.max_seconds} s")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,45 @@
-from splusdata.connect import connect
+import importlib
 
-from splusdata.features import filterbw
-from splusdata.features.hipscat import get_hipscats
+from splusdata.vars import *
 
-from splusdata.features.extinction import SplusExtinction
-from splusdata.features.zeropoints import get_zeropoint
+# Public names and the module they come from. They are imported on first access (PEP 562),
+# so `import splusdata; splusdata.Core` does not pull astropy, scipy, PIL or pandas.
+_LAZY_ATTRIBUTES = {
+    "Core": ("splusdata.core", "Core"),
+    "AsyncCore": ("splusdata.aiocore", "AsyncCore"),
+    "ResponseCache": ("splusdata.cache", "ResponseCache"),
+    "TokenCache": ("splusdata.cache", "TokenCache"),
+    "QueryCache": ("splusdata.cache", "QueryCache"),
+    "TapJobManager": ("splusdata.tapjobs", "TapJobManager"),
+    "connect": ("splusdata.connect", "connect"),
+    "filterbw": ("splusdata.features.filterbw", None),
+    "get_hipscats": ("splusdata.features.hipscat", "get_hipscats"),
+    "SplusExtinction": ("splusdata.features.extinction", "SplusExtinction"),
+    "get_zeropoint": ("splusdata.features.zeropoints", "get_zeropoint"),
+    "get_zeropoints": ("splusdata.features.zeropoints", "get_zeropoints"),
+    "ZeroPointTable": ("splusdata.features.zeropoints", "ZeroPointTable"),
+    "FootprintIndex": ("splusdata.features.footprint", "FootprintIndex"),
+    "vacs": ("splusdata.vacs", None),
+    "core": ("splusdata.core", None),
+    "features": ("splusdata.features", None),
+}
 
-import splusdata.vacs
+# `from splusdata import *` imports the lazy names too
+__all__ = ["BANDS", "WAVELENGHTS", *_LAZY_ATTRIBUTES]
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    module_name, attribute = _LAZY_ATTRIBUTES[name]
+    value = importlib.import_module(module_name)
+    if attribute is not None:
+        value = getattr(value, attribute)
+
+    globals()[name] = value
+    return value
 
-from splusdata.vars import *
 
-from splusdata.core import Core
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
@@ -0,0 +1,375 @@
+import asyncio
+import json
+import io
+import time
+
+from getpass import getpass
+
+from splusdata.core import (
+    AuthenticationError,
+    SplusError,
+    open_image,
+    save_image_bytes,
+    open_fits,
+    save_fits_bytes,
+    _tap_async_link,
+    _query_payload,
+    _upload_bytes,
+    _xml_text,
+    _result_link,
+    _print_votable_info,
+    _RUNNING_PHASES,
+    _JobPoller,
+    _frame_payload,
+    _stamp_payload,
+    _lupton_payload,
+    _trilogy_payload,
+    _detection_payload,
+    _checkcoords_payload,
+)
+
+
+class AsyncCore:
+    """
+    An asyncio client for the S-PLUS API, mirroring `Core`.
+
+    All requests go through one aiohttp connection pool, and at most `max_concurrency`
+    of them are in flight at the same time. Authentication happens on the first request
+    (or when entering the `async with` block), with the same login and collab check done
+    by `Core.authenticate`.
+
+    Parameters
+    ----------
+    username : str, optional
+        The username for the splus.cloud account. If not provided, the user will be prompted to enter it.
+    password : str, optional
+        The password for the splus.cloud account. If not provided, the user will be prompted to enter it.
+    SERVER_IP : str, optional
+        Server IP
+    auto_renew : bool, optional
+        Automatically try to renew splus token once is expired instead of loggin in again. (not so safe)
+    max_concurrency : int, optional
+        Maximum number of requests in flight. Defaults to 32.
+
+    ```python
+    import asyncio
+    from splusdata import AsyncCore
+
+    async def main():
+        async with AsyncCore("user", "pass", max_concurrency=64) as core:
+            coros = [core.stamp(ra, dec, 50, "R") for ra, dec in coords]
+            return await asyncio.gather(*coros, return_exceptions=True)
+
+    stamps = asyncio.run(main())
+    ```
+    """
+
+    def __init__(self, username=None, password=None, SERVER_IP = f"https://splus.cloud", auto_renew = False, max_concurrency = 32):
+        self.SERVER_IP = SERVER_IP
+        self.SERVER_URL = f"{self.SERVER_IP}/api"
+
+        self.auto_renew = auto_renew
+        self.max_concurrency = max_concurrency
+
+        self.username = username
+        # Kept until the first login, and afterwards only if auto_renew is set.
+        self.password = password
+
+        self.token = None
+        self.headers = None
+        self.collab = None
+        self.refresh_rate = 5
+        self.poll_interval = 0.1
+
+        self._session = None
+        self._semaphore = None
+        self._auth_lock = None
+
+    async def __aenter__(self):
+        await self._ensure_authenticated()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """Closes the connection pool."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        if self._session is None:
+            try:
+                import aiohttp
+            except ImportError:
+                raise ImportError("The 'aiohttp' package is required for AsyncCore.")
+
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._auth_lock = asyncio.Lock()
+        return self._session
+
+    async def _send(self, method, url, **kwargs):
+        """Sends one request under the concurrency semaphore. Returns (status, body bytes)."""
+        session = self._get_session()
+        async with self._semaphore:
+            async with session.request(method, url, **kwargs) as response:
+                return response.status, await response.read()
+
+    async def authenticate(self, username=None, password=None):
+        """
+        Authenticates the user with the S-PLUS API.
+
+        Parameters
+        ----------
+        username : str, optional
+            The username for the splus.cloud account. If not provided, the user will be prompted to enter it.
+        password : str, optional
+            The password for the splus.cloud account. If not provided, the user will be prompted to enter it.
+
+        Raises
+        ------
+        AuthenticationError
+            If authentication fails.
+        """
+        if not username:
+            username = input("splus.cloud username: ")
+            self.username = username
+        if not password:
+            password = getpass("splus.cloud password: ")
+
+        data = {'username': username, 'password': password}
+        status, content = await self._send('POST', f"{self.SERVER_URL}/auth/login", data=data)
+
+        if status != 200:
+            raise AuthenticationError("Authentication failed")
+
+        user_data = json.loads(content)
+        self.token = user_data['token']
+        self.headers = {'Authorization': 'Token ' + self.token}
+
+        status, content = await self._send('POST', f"{self.SERVER_URL}/auth/collab", headers=self.headers)
+        collab = json.loads(content)
+
+        self.collab = collab.get('collab') == 'yes'
+
+        self.password = password if self.auto_renew else None
+
+    async def _ensure_authenticated(self, expired_token=None):
+        """Logs in once, even when many coroutines need a token at the same time."""
+        self._get_session()
+        async with self._auth_lock:
+            if self.token is not None and self.token != expired_token:
+                return
+            if expired_token is not None:
+                print("Renewing splus session token.")
+            await self.authenticate(self.username, self.password)
+
+    async def _make_request(self, method, url, data=None, json_=None, params=None):
+        """
+        Makes a request to the S-PLUS API.
+
+        Parameters
+        ----------
+        method : str
+            The HTTP method to use for the request.
+        url : str
+            The URL to make the request to.
+        data : dict, optional
+            The data to include in the request body.
+        json_ : dict, optional
+            The JSON data to include in the request body.
+        params : dict, optional
+            The query parameters to include in the request.
+
+        Returns
+        -------
+        bytes
+            The body of the response.
+
+        Raises
+        ------
+        SplusError
+            If the response contains an error.
+        """
+        await self._ensure_authenticated()
+
+        token = self.token
+        status, content = await self._send(method, url, data=data, json=json_, params=params, headers=self.headers)
+
+        if self.auto_renew and status == 401:
+            await self._ensure_authenticated(expired_token=token)
+            status, content = await self._send(method, url, data=data, json=json_, params=params, headers=self.headers)
+
+        resjson = None
+        try:
+            resjson = json.loads(content)
+        except:
+            pass
+
+        if isinstance(resjson, dict) and 'error' in resjson:
+            raise SplusError(resjson['error'])
+        if status >= 400:
+            raise SplusError(f"{status} Error for url: {url}")
+
+        return content
+
+    async def field_frame(self, field, band, weight = False, filename=None, _data_release=None):
+        """
+        Downloads a FITS file for a given field and band. Same as `Core.field_frame`.
+
+        Returns
+        -------
+        astropy.io.fits.HDUList
+            The FITS data for the requested field and band.
+        """
+        data = _frame_payload(field, band, weight, _data_release)
+        content = await self._make_request('POST', f"{self.SERVER_URL}/download_frame", json_=data)
+
+        if filename:
+            save_fits_bytes(content, filename)
+        return open_fits(content)
+
+    async def stamp(self, ra, dec, size, band, weight = False, option = 1, filename=None, _data_release=None):
+        """
+        Downloads a FITS stamp for a given position and band. Same as `Core.stamp`.
+
+        Returns
+        -------
+        astropy.io.fits.HDUList
+            The FITS data for the requested position and band.
+        """
+        data = _stamp_payload(ra, dec, size, band, weight, option, _data_release)
+        content = await self._make_request('POST', f"{self.SERVER_URL}/download_stamp", json_=data)
+
+        if filename:
+            save_fits_bytes(content, filename)
+        return open_fits(content)
+
+    async def lupton_rgb(self, ra, dec, size, R="I", G="R", B="G", Q=8, stretch=3, option=1, filename=None, _data_release=None):
+        """
+        Downloads a lupton image. Same as `Core.lupton_rgb`.
+
+        Returns
+        -------
+        PIL.Image
+            The requested image.
+        """
+        data = _lupton_payload(ra, dec, size, R, G, B, Q, stretch, option, _data_release)
+        content = await self._make_request('POST', f"{self.SERVER_URL}/lupton_image", json_=data)
+
+        if filename:
+            save_image_bytes(content, filename)
+        return open_image(content)
+
+    async def trilogy_image(self, ra, dec, size, R="R,I,F861,Z", G="G,F515,F660", B="U,F378,F395,F410,F430", noiselum=0.15, satpercent=0.15, colorsatfac=2, option=1, filename=None, _data_release=None):
+        """
+        Downloads a trilogy image. Same as `Core.trilogy_image`.
+
+        Returns
+        -------
+        PIL.Image
+            The requested image.
+        """
+        data = _trilogy_payload(ra, dec, size, R, G, B, noiselum, satpercent, colorsatfac, option, _data_release)
+        content = await self._make_request('POST', f"{self.SERVER_URL}/trilogy_image", json_=data)
+
+        if filename:
+            save_image_bytes(content, filename)
+        return open_image(content)
+
+    async def stamp_detection(self, ra, dec, size, bands = "G, R, I, Z", return_weight = False, option = 1, filename=None, _data_release=None):
+        """
+        Retrieves a stamp detection image. Same as `Core.stamp_detection`.
+
+        Raises:
+            SplusError: If return_weight is True but filename is None.
+
+        Returns:
+            astropy.io.fits: If filename is None, returns a fits.
+        """
+        if return_weight and not filename:
+            raise SplusError("return_weight is True, but filename is None")
+
+        data = _detection_payload(ra, dec, size, bands, return_weight, option, _data_release)
+        content = await self._make_request('POST', f"{self.SERVER_URL}/stamp_detection_image", json_=data)
+
+        if filename:
+            with open(filename + ".zip", 'wb') as f:
+                f.write(content)
+            return
+        return open_fits(content)
+
+    async def checkcoords(self, ra, dec):
+        """
+        Check if the given coordinates are within the survey area. Same as `Core.checkcoords`.
+
+        Returns:
+            dict: A dictionary containing the result of the request.
+        """
+        data = _checkcoords_payload(ra, dec)
+        content = await self._make_request('POST', f"{self.SERVER_URL}/check_near_field", json_=data)
+        return json.loads(content)
+
+    async def query(self, query, table_upload=None, publicdata=None):
+        """Perform async queries on splus cloud TAP service. Same as `Core.query`.
+
+        Args:
+            query (str): query itself.
+            table_upload (pandas.DataFrame, optional): table to upload. Defaults to None.
+            publicdata (bool, optional): If internal wants to access public data. Defaults to None.
+
+        Returns:
+            astropy.table.Table: result table.
+        """
+        import aiohttp
+        from xml.dom import minidom
+        from astropy.table import Table
+
+        await self._ensure_authenticated()
+
+        baselink = _tap_async_link(self.SERVER_IP, self.collab, publicdata)
+        data = _query_payload(query)
+
+        if table_upload is not None:
+            IObytes = _upload_bytes(table_upload, query)
+            if isinstance(IObytes, str):
+                return IObytes
+
+            data['upload'] = 'upload,param:uplTable'
+            form = aiohttp.FormData(data)
+            form.add_field('uplTable', IObytes, filename='uplTable.xml')
+            status, content = await self._send('POST', baselink, data=form, headers=self.headers)
+        else:
+            status, content = await self._send('POST', baselink, data=data, headers=self.headers)
+
+        xmldoc = minidom.parse(io.BytesIO(content))
+
+        try:
+            process = _xml_text(xmldoc, 'phase')
+            jobID = _xml_text(xmldoc, 'jobId')
+
+            if process in _RUNNING_PHASES:
+                poller = _JobPoller(process, self.poll_interval, self.refresh_rate)
+                while True:
+                    start = time.monotonic()
+                    status, content = await self._send('GET', baselink + jobID, params=poller.params(), headers=self.headers)
+                    if poller.update(content, time.monotonic() - start):
+                        break
+                    await asyncio.sleep(poller.sleep)
+                xmldoc = poller.xmldoc
+                process = poller.phase
+
+            if process == 'COMPLETED':
+                link = _result_link(xmldoc, self.SERVER_IP)
+                status, content = await self._send('GET', link, headers=self.headers)
+
+                return Table.read(io.BytesIO(content))
+
+            if process == 'ERROR':
+                print("Error: ", _xml_text(xmldoc, 'message'))
+
+        except:
+            _print_votable_info(xmldoc)
@@ -0,0 +1,463 @@
+import os
+import re
+import json
+import zlib
+import hashlib
+import shutil
+import threading
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def default_cache_dir(name):
+    """Returns ~/.cache/splusdata/<name>, honouring XDG_CACHE_HOME."""
+    base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "splusdata", name)
+
+
+@contextmanager
+def atomic_path(path):
+    """
+    Yields a temporary path next to `path` to write to. It is moved onto `path` when the block
+    succeeds and removed when it fails, so readers (other threads or processes) never see a partial file.
+    """
+    partial = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        yield partial
+        os.replace(partial, path)
+    except BaseException:
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+        raise
+
+
+def cached_download(url, path, max_age=None, headers=None):
+    """
+    Local copy of `url` at `path`, downloaded when missing or older than `max_age` seconds
+    (by default it is kept forever). Returns `path`.
+    """
+    fresh = os.path.exists(path) and (max_age is None or time.time() - os.path.getmtime(path) < max_age)
+    if not fresh:
+        import requests
+
+        res = requests.get(url, headers=headers)
+        res.raise_for_status()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with atomic_path(path) as partial, open(partial, "wb") as f:
+            f.write(res.content)
+    return path
+
+
+class ResponseCache:
+    """
+    Two tier (memory + disk) cache for S-PLUS API responses.
+
+    The memory tier is an LRU holding the zlib compressed bodies. The disk tier is content
+    addressed: bodies are stored once under the sha256 of their content, and each request key
+    points to a body hash, so identical responses share one file. Both tiers are capped in
+    bytes and evict the least recently used entries first.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Directory of the disk tier, by default ~/.cache/splusdata/responses. If False, only the memory tier is used.
+    memory_size : int, optional
+        Maximum size of the memory tier in bytes (compressed), by default 256 MB.
+    disk_size : int, optional
+        Maximum size of the disk tier in bytes, by default 10 GB.
+    compress_level : int, optional
+        zlib level used in the memory tier, by default 1.
+
+    Attributes
+    ----------
+    stats : dict
+        Hit and miss counters of each tier.
+
+    ```python
+    core = Core(user, password, cache=ResponseCache(memory_size=512 * 1024**2))
+    core.stamp(ra, dec, 50, "R")
+    core.stamp(ra, dec, 50, "R")  # served from memory
+    core.cache.stats
+    ```
+    """
+
+    def __init__(self, cache_dir=None, memory_size=256 * 1024**2, disk_size=10 * 1024**3, compress_level=1):
+        if cache_dir is None:
+            cache_dir = default_cache_dir("responses")
+        self.cache_dir = cache_dir
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.compress_level = compress_level
+
+        self.stats = {"memory_hits": 0, "memory_misses": 0, "disk_hits": 0, "disk_misses": 0}
+
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._disk_used = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_memory"] = OrderedDict()
+        state["_memory_used"] = 0
+        state["_disk_used"] = None
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(url, payload=None, data_release=None):
+        """Builds the cache key of a request from its endpoint, JSON payload and data release."""
+        raw = json.dumps([url, payload, data_release], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key):
+        """Returns the cached body for `key`, or None."""
+        with self._lock:
+            compressed = self._memory.get(key)
+            if compressed is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return zlib.decompress(compressed)
+            self.stats["memory_misses"] += 1
+
+        content = self._disk_get(key)
+        if content is None:
+            self.stats["disk_misses"] += 1
+            return None
+
+        self.stats["disk_hits"] += 1
+        self._memory_put(key, content)
+        return content
+
+    def put(self, key, content):
+        """Stores `content` (bytes) in both tiers."""
+        self._memory_put(key, content)
+        self._disk_put(key, content)
+
+    def clear(self):
+        """Empties both tiers."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_used = 0
+            if self.cache_dir:
+                for folder in ("keys", "objects"):
+                    for root, _, files in os.walk(os.path.join(self.cache_dir, folder)):
+                        for file in files:
+                            os.remove(os.path.join(root, file))
+                self._disk_used = 0
+
+    ## Memory tier
+    def _memory_put(self, key, content):
+        compressed = zlib.compress(content, self.compress_level)
+        if len(compressed) > self.memory_size:
+            return
+
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_used -= len(old)
+
+            self._memory[key] = compressed
+            self._memory_used += len(compressed)
+
+            while self._memory_used > self.memory_size:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_used -= len(evicted)
+
+    ## Disk tier
+    def _key_path(self, key):
+        return os.path.join(self.cache_dir, "keys", key[:2], key)
+
+    def _object_path(self, digest):
+        return os.path.join(self.cache_dir, "objects", digest[:2], digest)
+
+    def _disk_get(self, key):
+        if not self.cache_dir:
+            return None
+        key_path = self._key_path(key)
+        try:
+            with open(key_path) as f:
+                path = self._object_path(f.read().strip())
+        except OSError:
+            return None
+
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+        except OSError:
+            # The object was evicted, drop the dangling key
+            try:
+                os.remove(key_path)
+            except OSError:
+                pass
+            return None
+
+        # mtime is the LRU clock of the disk tier
+        os.utime(path)
+        return content
+
+    def _disk_put(self, key, content):
+        if not self.cache_dir or len(content) > self.disk_size:
+            return
+
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._object_path(digest)
+
+        with self._lock:
+            if self._disk_used is None:
+                self._disk_used = self._scan_disk()
+
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with atomic_path(path) as partial, open(partial, "wb") as f:
+                    f.write(content)
+                self._disk_used += len(content)
+
+            key_path = self._key_path(key)
+            os.makedirs(os.path.dirname(key_path), exist_ok=True)
+            with open(key_path, "w") as f:
+                f.write(digest)
+
+            if self._disk_used > self.disk_size:
+                self._evict_disk()
+
+    def _scan_disk(self):
+        used = 0
+        for root, _, files in os.walk(os.path.join(self.cache_dir, "objects")):
+            for file in files:
+                used += os.path.getsize(os.path.join(root, file))
+        return used
+
+    def _evict_disk(self):
+        objects = []
+        for root, _, files in os.walk(os.path.join(self.cache_dir, "objects")):
+            for file in files:
+                path = os.path.join(root, file)
+                stat = os.stat(path)
+                objects.append((stat.st_mtime, stat.st_size, path))
+        objects.sort()
+
+        self._disk_used = sum(size for _, size, _ in objects)
+        for _, size, path in objects:
+            if self._disk_used <= self.disk_size:
+                break
+            os.remove(path)
+            self._disk_used -= size
+        # Keys pointing to evicted objects are dropped on their next lookup.
+
+
+class TokenCache:
+    """
+    On disk store of splus.cloud session tokens, so a new `Core` can skip the login round trips.
+
+    Entries are keyed by server and username and hold the token, the collab flag and the
+    token expiry. The file is only readable by its owner (0600), inside a 0700 folder.
+
+    Parameters
+    ----------
+    path : str, optional
+        File holding the tokens, by default ~/.cache/splusdata/auth/tokens.json.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(default_cache_dir("auth"), "tokens.json")
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(server, username):
+        return f"{server}|{username}"
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, entries):
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, mode=0o700, exist_ok=True)
+
+        with atomic_path(self.path) as partial:
+            fd = os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(entries, f)
+
+    def load(self, server, username):
+        """Returns the stored entry (dict with 'token', 'collab' and 'expiry') or None."""
+        entry = self._read().get(self._key(server, username))
+        if not entry:
+            return None
+        if entry.get("expiry") is not None and entry["expiry"] <= time.time():
+            return None
+        return entry
+
+    def save(self, server, username, token, collab, expiry=None):
+        with self._lock:
+            entries = self._read()
+            entries[self._key(server, username)] = {"token": token, "collab": collab, "expiry": expiry}
+            self._write(entries)
+
+    def remove(self, server, username):
+        with self._lock:
+            entries = self._read()
+            if entries.pop(self._key(server, username), None) is not None:
+                self._write(entries)
+
+
+def normalize_adql(query):
+    """
+    Normalizes an ADQL query for cache keys: comments dropped, whitespace collapsed, trailing ';'
+    removed and everything outside quotes lower cased (ADQL identifiers are case insensitive).
+    """
+    parts = re.split(r"('(?:[^']|'')*'|\"[^\"]*\")", query)
+    for i in range(0, len(parts), 2):
+        text = re.sub(r"--[^\n]*", " ", parts[i])
+        parts[i] = re.sub(r"\s+", " ", text).lower()
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+class QueryCache:
+    """
+    On disk cache of TAP query results, stored as FITS files and opened memory mapped on a hit.
+
+    Entries are keyed by the normalized ADQL, the TAP endpoint (public or collab, which also
+    tells the server) and the sha256 of the uploaded table. They expire `ttl` seconds after
+    being written, and the oldest entries are evicted once the folder is over `max_size` bytes.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Folder of the results, by default ~/.cache/splusdata/queries.
+    ttl : float, optional
+        Seconds a result stays valid, by default one day. None keeps results until evicted.
+    max_size : int, optional
+        Maximum size of the folder in bytes, by default 5 GB.
+
+    ```python
+    core = Core(user, password, query_cache=QueryCache(ttl=3600))
+    core.query("SELECT TOP 10 * FROM idr4_dual.idr4_dual_r")
+    core.query("select top 10 *  from idr4_dual.idr4_dual_r")  # from disk
+    ```
+    """
+
+    def __init__(self, cache_dir=None, ttl=24 * 3600, max_size=5 * 1024**3):
+        self.cache_dir = cache_dir or default_cache_dir("queries")
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self.stats = {"hits": 0, "misses": 0}
+        self._used = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_used"] = None
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query, endpoint, upload=None):
+        """Builds the key of a query from its ADQL, TAP endpoint and uploaded table (bytes)."""
+        upload_hash = hashlib.sha256(upload).hexdigest() if upload is not None else None
+        raw = json.dumps([normalize_adql(query), endpoint, upload_hash])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".fits")
+
+    def get(self, key):
+        """Returns the path of the cached result for `key`, or None if missing or expired."""
+        path = self._path(key)
+        try:
+            written = os.path.getmtime(path)
+        except OSError:
+            self.stats["misses"] += 1
+            return None
+
+        if self.ttl is not None and time.time() - written > self.ttl:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.stats["misses"] += 1
+            return None
+
+        self.stats["hits"] += 1
+        return path
+
+    def put(self, key, content=None, source=None):
+        """Stores a result, given as FITS bytes (`content`) or as a FITS file to copy (`source`). Returns its path."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with atomic_path(path) as partial:
+            if source is not None:
+                shutil.copyfile(source, partial)
+            else:
+                with open(partial, "wb") as f:
+                    f.write(content)
+
+        with self._lock:
+            if self._used is None:
+                self._used = self._scan()
+            else:
+                self._used += os.path.getsize(path)
+            if self._used > self.max_size:
+                self._evict()
+        return path
+
+    def clear(self):
+        """Removes every cached result."""
+        with self._lock:
+            for root, _, files in os.walk(self.cache_dir):
+                for file in files:
+                    os.remove(os.path.join(root, file))
+            self._used = 0
+
+    def _files(self):
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith(".fits"):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _scan(self):
+        return sum(size for _, size, _ in self._files())
+
+    def _evict(self):
+        files = sorted(self._files())
+        self._used = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if self._used <= self.max_size:
+                break
+            os.remove(path)
+            self._used -= size
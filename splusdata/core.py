@@ -2,9 +2,24 @@ import requests
 import time
 import json
 import io 
+import os
+import re
+import tempfile
+import shutil
+import uuid
+import threading
+import warnings
+import weakref
+
+from datetime import datetime
+
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
 
 from getpass import getpass
 
+from splusdata.throttle import TokenBucket, RETRY_STATUS, retry_after, backoff_delay
+from splusdata.cache import atomic_path
+
 # TODO: DEPRECATE and remove imports on old API
 
 ## Error handling
@@ -41,6 +56,397 @@ def save_fits(fits, filename):
                 sufix = ".fz"
     
     fits.writeto(filename + sufix, overwrite=True)
+
+def save_fits_bytes(fits_bytes, filename):
+    """Writes the FITS bytes as received from the server, adding '.fz' if the file is compressed. Returns the path written."""
+    if _is_compressed_fits(fits_bytes) and not ".fz" in filename:
+        filename = filename + ".fz"
+    with open(filename, 'wb') as f:
+        f.write(fits_bytes)
+    return filename
+
+_IMAGE_SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": (".png",),
+    b"\xff\xd8\xff": (".jpg", ".jpeg"),
+}
+
+def save_image_bytes(image_bytes, filename):
+    """Writes the image bytes as received when the filename extension matches their format, otherwise converts it with PIL."""
+    extension = os.path.splitext(filename)[1].lower()
+    for signature, extensions in _IMAGE_SIGNATURES.items():
+        if image_bytes.startswith(signature) and extension in extensions:
+            with open(filename, 'wb') as f:
+                f.write(image_bytes)
+            return
+    save_image(image_bytes, filename)
+
+# A compressed image is a BINTABLE extension with ZIMAGE = T, it shows up in the first header blocks.
+_COMPRESSED_FITS = re.compile(rb"ZIMAGE  =\s+T")
+_SNIFF_SIZE = 2880 * 8
+
+def _is_compressed_fits(head):
+    return _COMPRESSED_FITS.search(head[:_SNIFF_SIZE]) is not None
+
+def _stream_to_file(response, filename, fits_suffix=False, chunk_size=1024 * 1024):
+    """
+    Writes a streamed response to disk chunk by chunk, without holding the body in memory.
+    If `fits_suffix` is set, '.fz' is appended to the filename when the FITS is compressed.
+    Returns the path written.
+    """
+    # The first blocks tell if the FITS is compressed, before the file is named
+    chunks = response.iter_content(chunk_size=chunk_size)
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= _SNIFF_SIZE:
+            break
+    
+    if fits_suffix and _is_compressed_fits(head) and not ".fz" in filename:
+        filename = filename + ".fz"
+    with atomic_path(filename) as partial, open(partial, 'wb') as f:
+        f.write(head)
+        for chunk in chunks:
+            f.write(chunk)
+    return filename
+
+def _temp_filename(suffix):
+    return os.path.join(tempfile.gettempdir(), f"splusdata_{uuid.uuid4().hex}{suffix}")
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _remove_when_released(result, path):
+    """
+    Deletes the temporary file `path` once `result`, which reads from it, is garbage collected. 
+    Memory maps still open keep their data until unmapped (POSIX). Returns `result`.
+    """
+    weakref.finalize(result, _remove_file, path)
+    return result
+
+def _open_result(path, return_type='table'):
+    """
+    Opens a FITS result memory mapped, as an astropy Table ('table'), the FITS_rec structured 
+    array ('numpy') or a pyarrow Table ('arrow').
+    """
+    import numpy as np
+    from astropy.io import fits
+    from astropy.table import Table
+    
+    if return_type == 'numpy':
+        with fits.open(path, memmap=True) as hdul:
+            return hdul[1].data
+    
+    table = Table.read(path, format='fits', memmap=True)
+    if return_type == 'table':
+        return table
+    
+    if return_type == 'arrow':
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("The 'pyarrow' package is required for arrow results.")
+        
+        columns = {}
+        for name in table.colnames:
+            values = np.asarray(table[name])
+            mask = np.ma.getmaskarray(table[name]) if getattr(table[name], 'mask', None) is not None else None
+            if values.dtype.kind == 'S':
+                values = np.char.decode(values, 'ascii')
+            elif not values.dtype.isnative:
+                # FITS is big endian, arrow needs native order: the only copy made
+                values = values.astype(values.dtype.newbyteorder('='))
+            
+            if values.ndim > 1:
+                flat = pa.array(values.reshape(len(values), -1).ravel())
+                columns[name] = pa.FixedSizeListArray.from_arrays(flat, int(np.prod(values.shape[1:])))
+            else:
+                columns[name] = pa.array(values, mask=mask)
+        return pa.table(columns)
+    
+    raise ValueError("return_type must be 'table', 'numpy' or 'arrow'")
+
+def _parse_expiry(expiry):
+    """Returns the token expiry sent by the login endpoint as a unix timestamp, or None if absent."""
+    if not expiry:
+        return None
+    try:
+        return datetime.fromisoformat(str(expiry).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+def _cached_response(content, url):
+    """Wraps a cached body into a requests.Response, so callers can't tell it from a network one."""
+    response = requests.Response()
+    response._content = content
+    response.status_code = 200
+    response.url = url
+    response.headers['X-Splusdata-Cache'] = 'hit'
+    return response
+
+def _iter_coords(catalog, ra_col=None, dec_col=None):
+    """Yields (ra, dec) pairs from a DataFrame, astropy Table or iterable of pairs."""
+    columns = None
+    if hasattr(catalog, "columns") and hasattr(catalog, "iterrows"):
+        columns = list(catalog.columns)
+    elif hasattr(catalog, "colnames"):
+        columns = list(catalog.colnames)
+    
+    if columns is None:
+        for ra, dec in catalog:
+            yield ra, dec
+        return
+    
+    for col in columns:
+        if ra_col is None and col.lower() == "ra":
+            ra_col = col
+        elif dec_col is None and col.lower() == "dec":
+            dec_col = col
+    
+    if ra_col is None or dec_col is None:
+        raise ValueError("Catalog does not have columns 'ra' and 'dec'")
+    
+    for ra, dec in zip(catalog[ra_col], catalog[dec_col]):
+        yield ra, dec
+
+## TAP helpers, shared by Core and AsyncCore
+def _tap_async_link(server_ip, collab, publicdata=None):
+    if collab and not publicdata:
+        return f"{server_ip}/tap/tap/async/"
+    return f"{server_ip}/public-TAP/tap/async/"
+
+def _tap_sync_link(server_ip, collab, publicdata=None):
+    return _tap_async_link(server_ip, collab, publicdata)[:-len("async/")] + "sync"
+
+# Seconds to wait for the TAP capabilities (row limit) before giving up on it
+CAPABILITIES_TIMEOUT = 2
+
+# Queries expected to be small enough for the TAP sync endpoint
+SYNC_MAX_TOP = 10000
+SYNC_MAX_UPLOAD = 500
+
+def _is_small_query(query, upload_rows=None):
+    """True for queries with a `TOP n` of at most SYNC_MAX_TOP rows, or with an upload of at most SYNC_MAX_UPLOAD rows."""
+    top = re.search(r'\bselect\s+(?:all\s+|distinct\s+)?top\s+(\d+)', query, re.IGNORECASE)
+    if top and int(top.group(1)) <= SYNC_MAX_TOP:
+        return True
+    return upload_rows is not None and upload_rows <= SYNC_MAX_UPLOAD
+
+def _table_rows(table_upload):
+    if 'astropy.io.votable' in str(type(table_upload)):
+        return len(table_upload.get_first_table().array)
+    return len(table_upload)
+
+def _range_predicate(column, start, end, last=False):
+    return f"{column} >= {start!r} AND {column} {'<=' if last else '<'} {end!r}"
+
+def _strip_comments(query):
+    """Removes the `--` comments of an ADQL query, keeping string literals untouched."""
+    return re.sub(r"('(?:[^']|'')*')|--[^\n]*", lambda match: match.group(1) or "", query)
+
+def _add_predicate(query, predicate):
+    """Adds a predicate to the WHERE clause of a query, creating it if needed."""
+    query = _strip_comments(query)
+    where = re.search(r'\bwhere\b', query, re.IGNORECASE)
+    tail = re.search(r'\b(group\s+by|having|order\s+by|offset)\b', query[where.end() if where else 0:], re.IGNORECASE)
+    
+    start = where.end() if where else 0
+    end = start + tail.start() if tail else len(query.rstrip().rstrip(';'))
+    if where:
+        return f"{query[:start]} ({predicate}) AND ({query[start:end].strip()}) {query[end:]}".rstrip()
+    return f"{query[:end].rstrip()} WHERE {predicate} {query[end:]}".rstrip()
+
+## API payloads, shared by Core and AsyncCore
+def _frame_payload(field, band, weight=False, _data_release=None):
+    return {
+        "fieldname": field,
+        "band": band,
+        "weight": weight,
+        "dr": _data_release
+    }
+
+def _stamp_payload(ra, dec, size, band, weight=False, option=1, _data_release=None):
+    return {
+        "ra": ra,
+        "dec": dec,
+        "band": band,
+        "option": str(option),
+        "size": size,
+        "weight": weight,
+        "dr": _data_release
+    }
+
+def _lupton_payload(ra, dec, size, R, G, B, Q, stretch, option, _data_release):
+    return {
+        "ra": ra,
+        "dec": dec,
+        "size": size,
+        "R": R,
+        "G": G,
+        "B": B,
+        "Q": Q,
+        "stretch": stretch,
+        "option": str(option),
+        "dr": _data_release
+    }
+
+def _trilogy_payload(ra, dec, size, R, G, B, noiselum, satpercent, colorsatfac, option, _data_release):
+    return {
+        "ra": ra,
+        "dec": dec,
+        "size": size,
+        "reqOrder": f"{R}-{G}-{B}",
+        "noiselum": noiselum,
+        "satpercent": satpercent,
+        "colorsatfac": colorsatfac,
+        "option": str(option),
+        "dr": _data_release
+    }
+
+def _detection_payload(ra, dec, size, bands, return_weight, option, _data_release):
+    return {
+        "ra": ra,
+        "dec": dec,
+        "size": size,
+        "bands": str(bands).replace("[", "").replace("]", "").replace("'", "").replace(" ", ""),
+        "return_weight": return_weight,
+        "option": str(option),
+        "dr": _data_release
+    }
+
+def _checkcoords_payload(ra, dec):
+    return {
+        "ra": ra,
+        "dec": dec,
+    }
+
+def _query_payload(query):
+    return {
+        "request": 'doQuery',
+        "version": '1.0',
+        "lang": 'ADQL',
+        "phase": 'run',
+        "query": query,
+        "format": 'fits'
+    }
+
+# Maximum number of rows the TAP service accepts in an uploaded table
+UPLOAD_LIMIT = 6000
+
+def _split_upload(table_upload, chunk_size=UPLOAD_LIMIT):
+    """Splits an astropy Table, VOTable or DataFrame into astropy Tables of at most `chunk_size` rows."""
+    from astropy.table import Table
+    
+    if 'astropy.io.votable' in str(type(table_upload)):
+        table_upload = table_upload.get_first_table().to_table()
+    elif 'DataFrame' in str(type(table_upload)):
+        table_upload = Table.from_pandas(table_upload)
+    elif 'astropy.table' not in str(type(table_upload)):
+        raise SplusError('Table type not supported')
+    
+    return [table_upload[start:start + chunk_size] for start in range(0, len(table_upload), chunk_size)]
+
+def _referenced_columns(query, colnames):
+    """
+    Columns of an uploaded table that the ADQL may use: every name appearing as an identifier in it.
+    All columns are kept if the query selects `*` or `alias.*`, or if no name matches.
+    """
+    if query is None or re.search(r'(^|[\s,(])(\w+\.)?\*', query):
+        return list(colnames)
+    
+    identifiers = set()
+    for quoted, plain in re.findall(r'"([^"]+)"|([A-Za-z_]\w*)', query):
+        identifiers.add(quoted or plain.lower())
+    
+    columns = [col for col in colnames if col in identifiers or col.lower() in identifiers]
+    return columns or list(colnames)
+
+def _upload_bytes(table_upload, query=None):
+    """
+    Serializes the table to upload as an in memory BINARY2 VOTable, keeping only the columns 
+    the query references. Returns an error message (str) if the table can't be uploaded.
+    """
+    from astropy.io.votable import from_table, writeto
+    from astropy.table import Table
+    
+    if 'astropy.table' in str(type(table_upload)):
+        if len(table_upload) > UPLOAD_LIMIT:
+            print(f'Cutting to the first {UPLOAD_LIMIT} objects!')
+            table_upload = table_upload[0:UPLOAD_LIMIT]
+
+    elif 'astropy.io.votable' in str(type(table_upload)):
+        table_upload = table_upload.get_first_table().to_table()
+        if len(table_upload) > UPLOAD_LIMIT:
+            return f'votable bigger than {UPLOAD_LIMIT}'
+
+    elif 'DataFrame' in str(type(table_upload)):
+        if len(table_upload) > UPLOAD_LIMIT:
+            print(f'Cutting to the first {UPLOAD_LIMIT} objects!')
+            table_upload = table_upload[0:UPLOAD_LIMIT]
+        table_upload = table_upload[_referenced_columns(query, table_upload.columns)]
+        table_upload = Table.from_pandas(table_upload)
+
+    else:
+        return 'Table type not supported'
+    
+    table_upload = table_upload[_referenced_columns(query, table_upload.colnames)]
+    
+    IObytes = io.BytesIO()
+    writeto(from_table(table_upload), IObytes, tabledata_format='binary2')
+    IObytes.seek(0)
+    return IObytes
+
+_RUNNING_PHASES = ('PENDING', 'QUEUED', 'EXECUTING')
+
+class _JobPoller:
+    """
+    Polling schedule of an UWS job, shared by the sync and asyncio clients.
+    
+    Polls start every `poll_interval` seconds and back off (x1.5) up to `refresh_rate`. Each poll
+    also asks the server to block until the phase changes (UWS 1.1 WAIT), so a server that 
+    supports it answers as soon as the job finishes.
+    """
+    
+    def __init__(self, phase, poll_interval, refresh_rate):
+        self.phase = phase
+        self.delay = poll_interval
+        self.refresh_rate = refresh_rate
+        self.xmldoc = None
+        self.sleep = 0
+    
+    def params(self):
+        return {'WAIT': max(1, round(self.delay)), 'PHASE': self.phase}
+    
+    def update(self, content, elapsed):
+        """Reads a poll answer, True when the job left the running phases. Otherwise sets `sleep` before the next poll."""
+        from xml.dom import minidom
+        
+        self.xmldoc = minidom.parse(io.BytesIO(content))
+        self.phase = _xml_text(self.xmldoc, 'phase')
+        if self.phase not in _RUNNING_PHASES:
+            return True
+        
+        self.sleep = max(0, self.delay - elapsed)
+        self.delay = min(self.delay * 1.5, self.refresh_rate)
+        return False
+
+def _xml_text(xmldoc, tag):
+    return xmldoc.getElementsByTagName(tag)[0].firstChild.data
+
+def _result_link(xmldoc, server_ip):
+    item = xmldoc.getElementsByTagName('result')[0]
+    link = item.attributes['xlink:href'].value
+    
+    # The TAP service answers with its internal address
+    for internal in ["http://192.168.10.23:8080", "http://10.180.0.209:8080", "http://10.180.0.207:8080", "http://10.180.0.219:8080"]:
+        link = link.replace(internal, f"{server_ip}")
+    return link
+
+def _print_votable_info(xmldoc):
+    item = xmldoc.getElementsByTagName('INFO')
+    print(item[0].attributes['value'].value, ": ", item[0].firstChild.data)
     
 # ----------------------------
 
@@ -83,9 +489,13 @@ class Core:
         Gets information about a given data file.
     fetch_mar_file(file, filename=None)
         Downloads a data file.
+    stamps(catalog, bands, size, workers=8)
+        Downloads stamps for a whole catalog concurrently.
     """
 
-    def __init__(self, username=None, password=None, SERVER_IP = f"https://splus.cloud", auto_renew = False):
+    def __init__(self, username=None, password=None, SERVER_IP = f"https://splus.cloud", auto_renew = False, cache = None,
+                 max_retries = 3, backoff_factor = 0.5, rate_limit = None, pool_maxsize = requests.adapters.DEFAULT_POOLSIZE,
+                 token_cache = None, query_cache = None):
         """
         Initializes a new instance of the Core class.
 
@@ -99,6 +509,25 @@ class Core:
             Server IP 
         auto_renew : bool, optional
             Automatically try to renew splus token once is expired instead of loggin in again. (not so safe)
+        cache      : bool or splusdata.cache.ResponseCache, optional
+            Cache API responses (stamps, frames, images, checkcoords...) in memory and on disk. 
+            True uses a `ResponseCache` with default settings. Disabled by default.
+        max_retries : int, optional
+            Retries of a request after a connection error, a timeout, a 429 or a 5xx. Defaults to 3.
+        backoff_factor : float, optional
+            Base of the exponential backoff between retries, in seconds. A Retry-After header takes precedence. Defaults to 0.5.
+        rate_limit : float, optional
+            Maximum requests per second, shared by every thread using this instance. Defaults to no limit.
+        pool_maxsize : int, optional
+            Number of connections kept alive by the session. Defaults to 10.
+        token_cache : bool or splusdata.cache.TokenCache, optional
+            Reuse the token of a previous session stored on disk instead of logging in. The token 
+            is checked on the first request, and a new login happens only if it was revoked. 
+            True uses a `TokenCache` with default settings. Disabled by default.
+        query_cache : bool or splusdata.cache.QueryCache, optional
+            Keep `query` results on disk, so an identical query (same ADQL up to case and 
+            whitespace, same endpoint and upload) is read back instead of running a new job.
+            True uses a `QueryCache` with default settings. Disabled by default.
         
         """
         self.SERVER_IP = SERVER_IP
@@ -106,15 +535,98 @@ class Core:
         
         self.auto_renew = auto_renew
         
+        if cache is True:
+            from splusdata.cache import ResponseCache
+            cache = ResponseCache()
+        self.cache = cache or None
+        
+        if query_cache is True:
+            from splusdata.cache import QueryCache
+            query_cache = QueryCache()
+        self.query_cache = query_cache or None
+        
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.rate_limiter = TokenBucket(rate_limit) if rate_limit else None
+        
         self.session = requests.Session()
+        self._ensure_pool_size(pool_maxsize)
         
         self.username = username
         self.password = None
         if self.auto_renew:
             self.password = password
+        
+        self.token_expiry = None
+        # Seconds before token_expiry at which auto_renew logs in again
+        self.renew_margin = 60
+        self._auth_lock = threading.Lock()
+        # TAP jobs are polled every poll_interval seconds at first, backing off up to refresh_rate
+        self.refresh_rate = 5
+        self.poll_interval = 0.1
+        # Seconds before a sync query falls back to an async job
+        self.sync_timeout = 10
+        self._output_limits = {}
+        
+        if token_cache is True:
+            from splusdata.cache import TokenCache
+            token_cache = TokenCache()
+        self.token_cache = token_cache or None
+        
+        self._token_validated = True
+        self._login_password = None
+        if self.token_cache is not None:
+            if not self.username:
+                self.username = input("splus.cloud username: ")
+            if self._load_cached_token():
+                # Needed only if the cached token turns out to be invalid
+                self._login_password = password
+                return
             
         self.authenticate(self.username, password)
-        self.refresh_rate = 5
+    
+    def __getstate__(self):
+        # Sessions and locks can't be pickled, process pool workers get fresh ones and keep the token.
+        state = self.__dict__.copy()
+        del state["session"]
+        del state["_auth_lock"]
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.session = requests.Session()
+        self._auth_lock = threading.Lock()
+        pool_maxsize = self.__dict__.pop("_pool_maxsize", 0)
+        self._ensure_pool_size(pool_maxsize)
+    
+    def _load_cached_token(self):
+        entry = self.token_cache.load(self.SERVER_IP, self.username)
+        if entry is None:
+            return False
+        
+        self.headers = {'Authorization': 'Token ' + entry['token']}
+        self.token = entry['token']
+        self.collab = entry['collab']
+        self.token_expiry = entry.get('expiry')
+        self._token_validated = False
+        return True
+    
+    def _validate_token(self):
+        """Checks a token loaded from the token cache against the server (once), logging in again if it was revoked."""
+        if self._token_validated:
+            return
+        
+        token = self.token
+        response = self._send('POST', f"{self.SERVER_URL}/auth/collab")
+        if response.status_code == 401:
+            self._renew_token(token)
+        else:
+            self.collab = response.json().get('collab') == 'yes'
+            self._token_checked()
+    
+    def _token_checked(self):
+        self._token_validated = True
+        self._login_password = None
 
 
     def authenticate(self, username=None, password=None):
@@ -135,6 +647,7 @@ class Core:
         """
         if not username:
             username = input("splus.cloud username: ")
+            self.username = username
         if not password:    
             password = getpass("splus.cloud password: ")
             if self.auto_renew:
@@ -147,15 +660,68 @@ class Core:
             raise AuthenticationError("Authentication failed")
 
         user_data = json.loads(response.content)
+        # headers first, so a thread that sees the new token also sends it
+        self.headers = {'Authorization': 'Token ' + user_data['token']}
         self.token = user_data['token']
-        self.headers = {'Authorization': 'Token ' + self.token}
+        self.token_expiry = _parse_expiry(user_data.get('expiry'))
 
         response = self.session.post(f"{self.SERVER_URL}/auth/collab", headers=self.headers)
         collab = json.loads(response.content)
 
         self.collab = collab.get('collab') == 'yes'
         
-    def _make_request(self, method, url, data=None, json_=None, params=None):
+        self._token_checked()
+        if self.token_cache is not None:
+            self.token_cache.save(self.SERVER_IP, username, self.token, self.collab, self.token_expiry)
+    
+    def _renew_token(self, expired_token):
+        """
+        Logs in again, once for all threads: the first caller renews while the others 
+        wait on the lock and then reuse its token instead of logging in themselves.
+        """
+        with self._auth_lock:
+            if self.token != expired_token:
+                return
+            print("Renewing splus session token.")
+            if not self._token_validated:
+                self.token_cache.remove(self.SERVER_IP, self.username)
+            self.authenticate(self.username, self.password or self._login_password)
+    
+    def _token_expiring(self):
+        return self.token_expiry is not None and time.time() > self.token_expiry - self.renew_margin
+        
+    def _send(self, method, url, **kwargs):
+        """
+        Sends a request through the rate limiter, retrying connection errors, 429 and 5xx 
+        responses with exponential backoff (or the delay asked in Retry-After).
+        """
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            
+            try:
+                response = self.session.request(method, url, headers=self.headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                delay = backoff_delay(attempt, self.backoff_factor)
+            else:
+                if response.status_code not in RETRY_STATUS or attempt >= self.max_retries:
+                    return response
+                
+                delay = retry_after(response)
+                if delay is None:
+                    delay = backoff_delay(attempt, self.backoff_factor)
+                if response.status_code == 429 and self.rate_limiter is not None:
+                    # Hold every caller of this instance, not only this one
+                    self.rate_limiter.pause(delay)
+                response.close()
+            
+            time.sleep(delay)
+            attempt += 1
+    
+    def _make_request(self, method, url, data=None, json_=None, params=None, stream=False):
         """
         Makes a request to the S-PLUS API.
 
@@ -171,6 +737,8 @@ class Core:
             The JSON data to include in the request body.
         params : dict, optional
             The query parameters to include in the request.
+        stream : bool, optional
+            If True the body is not downloaded up front, read it with `response.iter_content`.
 
         Returns
         -------
@@ -182,30 +750,48 @@ class Core:
         SplusError
             If the response contains an error.
         """
-        response = self.session.request(method, url, data=data, json=json_, params=params, headers=self.headers)
+        cache_key = None
+        if self.cache is not None and not stream and json_ is not None:
+            cache_key = self.cache.key(url, json_, json_.get("dr"))
+            content = self.cache.get(cache_key)
+            if content is not None:
+                return _cached_response(content, url)
         
-        if self.auto_renew and response.status_code == 401:
-            print("Renewing splus session token.")
-            self.authenticate(self.username, self.password)
-            response = self.session.request(method, url, data=data, json=json_, params=params, stream=True, headers=self.headers)
+        if self.auto_renew and self._token_expiring():
+            self._renew_token(self.token)
+        
+        token = self.token
+        response = self._send(method, url, data=data, json=json_, params=params, stream=stream)
+        
+        if response.status_code == 401 and (self.auto_renew or not self._token_validated):
+            # A streamed response keeps its pooled connection until closed
+            response.close()
+            self._renew_token(token)
+            response = self._send(method, url, data=data, json=json_, params=params, stream=stream)
+        elif not self._token_validated and response.status_code < 400:
+            self._token_checked()
 
         resjson = None
-        try:
-            resjson = response.json()
-        except:
-            pass
+        # A streamed body is only read here if it is an (error) json, files are left to the caller.
+        if not stream or 'json' in response.headers.get('Content-Type', ''):
+            try:
+                resjson = response.json()
+            except:
+                pass
         
-        if resjson:
-            if 'error' in resjson:
-                raise SplusError(resjson['error'])
-            else:
-                response.raise_for_status()  # Raise an exception for HTTP errors
-        else:
+        if resjson and 'error' in resjson:
+            response.close()
+            raise SplusError(resjson['error'])
+        if response.status_code >= 400:
+            response.close()
             response.raise_for_status()  # Raise an exception for HTTP errors
         
+        if cache_key is not None:
+            self.cache.put(cache_key, response.content)
+        
         return response
     
-    def field_frame(self, field, band, weight = False, filename=None, _data_release=None):
+    def field_frame(self, field, band, weight = False, filename=None, _data_release=None, stream=False):
         """
         Downloads a FITS file for a given field and band.
 
@@ -219,24 +805,32 @@ class Core:
             The name of the file to save the FITS data to.
         _data_release : str, optional
             The data release to download the FITS file for.
+        stream : bool, optional
+            Write the response to `filename` (a temporary file if not given) as it arrives 
+            and return it memory mapped, so the frame is never fully held in memory. The 
+            temporary file is deleted when the returned HDUList is garbage collected.
 
         Returns
         -------
         astropy.io.fits.HDUList
             The FITS data for the requested field and band.
         """
-        data = {
-            "fieldname": field,
-            "band": band,
-            "weight": weight,
-            "dr": _data_release
-        }
+        data = _frame_payload(field, band, weight, _data_release)
+        if stream:
+            from astropy.io import fits
+            
+            res = self._make_request('POST', f"{self.SERVER_URL}/download_frame", json_=data, stream=True)
+            if filename:
+                return fits.open(_stream_to_file(res, filename, fits_suffix=True), memmap=True)
+            
+            path = _stream_to_file(res, _temp_filename(".fits"), fits_suffix=True)
+            return _remove_when_released(fits.open(path, memmap=True), path)
+        
         res = self._make_request('POST', f"{self.SERVER_URL}/download_frame", json_=data)
         
-        frame = open_fits(res.content)
         if filename:
-            save_fits(frame, filename=filename)
-        return frame
+            save_fits_bytes(res.content, filename)
+        return open_fits(res.content)
     
     
     # ----------------------------
@@ -289,7 +883,7 @@ class Core:
         res = self._make_request('POST', f"{self.SERVER_URL}/get_info_mar", json_=data)
         return res.json()
 
-    def fetch_mar_file(self, file, filename=None):
+    def fetch_mar_file(self, file, filename=None, stream=False):
         """
         Downloads a data file.
 
@@ -299,6 +893,11 @@ class Core:
             The name of the file to download.
         filename : str, optional
             The name of the file to save the downloaded data to.
+        stream : bool, optional
+            Write the response to `filename` (a temporary file if not given) as it arrives. 
+            FITS files are then returned memory mapped and other files as their path. A 
+            temporary FITS or PNG is deleted when the returned object is garbage collected, 
+            the temporary file of other types is left to the caller.
 
         Returns
         -------
@@ -312,6 +911,27 @@ class Core:
         """
         # get_file_mar
         
+        if stream:
+            from astropy.io import fits
+            
+            res = self._make_request('POST', f"{self.SERVER_URL}/get_file_mar", json_={"filename": file}, stream=True)
+            temporary = not filename
+            filename = _stream_to_file(res, filename or _temp_filename(os.path.splitext(file)[1]))
+            try:
+                if '.png' in file:
+                    from PIL import Image
+                    result = Image.open(filename)
+                elif '.fits' in file:
+                    result = fits.open(filename, memmap=True)
+                else:
+                    return filename
+            except:
+                if temporary:
+                    _remove_file(filename)
+                raise SplusError("File not recognized, may be corrupted or not exist")
+            
+            return _remove_when_released(result, filename) if temporary else result
+        
         res = self._make_request('POST', f"{self.SERVER_URL}/get_file_mar", json_={"filename": file})
         
         if filename:
@@ -357,21 +977,100 @@ class Core:
         astropy.io.fits.HDUList
             The FITS data for the requested field and band.
         """
-        data = {
-            "ra": ra,
-            "dec": dec,
-            "band": band,
-            "option": str(option),
-            "size": size,
-            "weight": weight,
-            "dr": _data_release
-        }
+        return self._stamp(ra, dec, size, band, weight, option, filename, _data_release)[0]
+    
+    def _stamp(self, ra, dec, size, band, weight=False, option=1, filename=None, _data_release=None):
+        """Downloads a stamp like `stamp`. Returns (HDUList, path written or None), the path ending in '.fz' if the stamp is compressed."""
+        data = _stamp_payload(ra, dec, size, band, weight, option, _data_release)
         res = self._make_request('POST', f"{self.SERVER_URL}/download_stamp", json_=data)
         
-        frame = open_fits(res.content)
         if filename:
-            save_fits(frame, filename=filename)
-        return frame
+            filename = save_fits_bytes(res.content, filename)
+        return open_fits(res.content), filename
+    
+    def _ensure_pool_size(self, size):
+        """Mounts a connection pool on the session able to keep `size` connections alive."""
+        if size <= getattr(self, "_pool_maxsize", 0):
+            return
+        adapter = requests.adapters.HTTPAdapter(pool_connections=size, pool_maxsize=size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._pool_maxsize = size
+    
+    def stamps(self, catalog, bands, size, workers=8, weight=False, option=1, output_folder=None, ra_col=None, dec_col=None, _data_release=None):
+        """
+        Downloads stamps for every row of a catalog concurrently.
+
+        The requests are the same `/download_stamp` calls made by `stamp`, run on a
+        bounded thread pool sharing this instance's session. Results are yielded as
+        they complete, so the order is not the catalog order. A failing item does not
+        abort the batch, its exception is reported in the `error` key.
+
+        Parameters
+        ----------
+        catalog : pandas.DataFrame, astropy.table.Table or iterable of (ra, dec)
+            The positions to download. Tables must have 'ra' and 'dec' columns (case insensitive) unless `ra_col` and `dec_col` are given.
+        bands : str or list of str
+            The band, or list of bands, to download for each position.
+        size : float
+            The size of the stamps in arcseconds.
+        workers : int, optional
+            Maximum number of requests in flight. Defaults to 8.
+        weight : bool, optional
+            Whether to download the weight maps.
+        option : int, optional
+            The option to use for the match 1 -> first match, 2 -> second match.
+        output_folder : str, optional
+            If provided, each stamp is saved as `{ra}_{dec}_{size}_{band}.fits` inside this folder
+            (`.fits.fz` for compressed stamps).
+        ra_col : str, optional
+            Name of the RA column of the catalog.
+        dec_col : str, optional
+            Name of the DEC column of the catalog.
+        _data_release : str, optional
+            The data release to download the stamps for.
+
+        Yields
+        ------
+        dict
+            With keys 'ra', 'dec', 'band', 'filename' (path written, None if not saved), 'data' (astropy.io.fits.HDUList or None) and 'error' (Exception or None).
+        """
+        if isinstance(bands, str):
+            bands = [bands]
+        
+        if output_folder and not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+        
+        self._ensure_pool_size(workers)
+        
+        def _download(ra, dec, band):
+            filename = None
+            if output_folder:
+                filename = os.path.join(output_folder, f"{ra}_{dec}_{size}_{band}.fits")
+            
+            item = {"ra": ra, "dec": dec, "band": band, "filename": None, "data": None, "error": None}
+            try:
+                item["data"], item["filename"] = self._stamp(ra, dec, size, band, weight, option, filename, _data_release)
+            except Exception as e:
+                item["error"] = e
+            return item
+        
+        jobs = ((ra, dec, band) for ra, dec in _iter_coords(catalog, ra_col, dec_col) for band in bands)
+        
+        # Keep at most 2 * workers futures alive, so huge catalogs are not materialized at once.
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for job in jobs:
+                pending.add(executor.submit(_download, *job))
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
     
     def lupton_rgb(self, ra, dec, size, R="I", G="R", B="G", Q=8, stretch=3, option=1, filename=None, _data_release=None):
         """
@@ -407,25 +1106,12 @@ class Core:
         astropy.io.fits.HDUList
             The FITS data for the requested field and band.
         """
-        data = {
-            "ra": ra,
-            "dec": dec,
-            "size": size,
-            "R": R,
-            "G": G,
-            "B": B,
-            "Q": Q,
-            "stretch": stretch,
-            "option": str(option),
-            "dr": _data_release
-        }
+        data = _lupton_payload(ra, dec, size, R, G, B, Q, stretch, option, _data_release)
         res = self._make_request('POST', f"{self.SERVER_URL}/lupton_image", json_=data)
         
-        
-        frame = open_image(res.content)
         if filename:
-            save_image(res.content, filename=filename)
-        return frame
+            save_image_bytes(res.content, filename)
+        return open_image(res.content)
     
     def trilogy_image(self, ra, dec, size, R="R,I,F861,Z", G="G,F515,F660", B="U,F378,F395,F410,F430", noiselum=0.15, satpercent=0.15, colorsatfac=2, option=1, filename=None, _data_release=None):
         """
@@ -463,23 +1149,12 @@ class Core:
         astropy.io.fits.HDUList
             The FITS data for the requested field and band.
         """
-        data = {
-            "ra": ra,
-            "dec": dec,
-            "size": size,
-            "reqOrder": f"{R}-{G}-{B}",
-            "noiselum": noiselum,
-            "satpercent": satpercent,
-            "colorsatfac": colorsatfac,
-            "option": str(option),
-            "dr": _data_release
-        }
+        data = _trilogy_payload(ra, dec, size, R, G, B, noiselum, satpercent, colorsatfac, option, _data_release)
         res = self._make_request('POST', f"{self.SERVER_URL}/trilogy_image", json_=data)
         
-        frame = open_image(res.content)
         if filename:
-            save_image(res.content, filename=filename)
-        return frame
+            save_image_bytes(res.content, filename)
+        return open_image(res.content)
     
     def stamp_detection(self, ra, dec, size, bands = "G, R, I, Z", return_weight = False, option = 1, filename=None, _data_release=None):
             """
@@ -505,23 +1180,15 @@ class Core:
             if return_weight and not filename:
                 raise SplusError("return_weight is True, but filename is None")
             
-            data = {
-                "ra": ra,
-                "dec": dec,
-                "size": size,
-                "bands": str(bands).replace("[", "").replace("]", "").replace("'", "").replace(" ", ""),
-                "return_weight": return_weight,
-                "option": str(option),
-                "dr": _data_release
-            }
+            data = _detection_payload(ra, dec, size, bands, return_weight, option, _data_release)
             
             res = self._make_request('POST', f"{self.SERVER_URL}/stamp_detection_image", json_=data)
             
-            frame = open_fits(res.content)
             if filename:
-                open(filename + ".zip", 'wb').write(res.content)
+                with open(filename + ".zip", 'wb') as f:
+                    f.write(res.content)
                 return 
-            return frame
+            return open_fits(res.content)
     
     def checkcoords(self, ra, dec):
             """
@@ -534,138 +1201,383 @@ class Core:
             Returns:
                 dict: A dictionary containing the result of the request.
             """
-            data = {
-                "ra": ra,
-                "dec": dec,
-            }
+            data = _checkcoords_payload(ra, dec)
             res = self._make_request('POST', f"{self.SERVER_URL}/check_near_field", json_=data)
             return res.json()
     
     ## query method (same from old API)
-    def query(self, query, table_upload=None, publicdata=None):
-        from astropy.io.votable import from_table, writeto
-        from xml.dom import minidom
-        from astropy.table import Table
-        
+    def query(self, query, table_upload=None, publicdata=None, chunked=False, max_jobs=4, filename=None, stream=False, return_type='table', mode='auto', paginate=False):
         """Perform async queries on splus cloud TAP service. 
 
         Args:
             query (str): query itself.
             table_upload (pandas.DataFrame, optional): table to upload. Defaults to None.
             publicdata (bool, optional): If internal wants to access public data. Defaults to None.
+            chunked (bool, optional): Upload tables bigger than 6000 rows in chunks of 6000 rows, one job each, instead of cutting them. The results are stacked in memory, so `filename`, `stream` and `return_type` can't be used with it. Defaults to False.
+            max_jobs (int, optional): Maximum number of chunk jobs running at the same time when `chunked`. Defaults to 4.
+            filename (str, optional): Streams the FITS result to this file (gzip compressed in transit) and opens it memory mapped, instead of reading it in memory. Defaults to None.
+            stream (bool, optional): Like `filename`, in a temporary file deleted when the returned result is garbage collected. Defaults to False.
+            return_type (str, optional): With `filename` or `stream`: 'table' (astropy Table), 'numpy' (structured array) or 'arrow' (pyarrow Table). Defaults to 'table'.
+            mode (str, optional): 'async' runs an UWS job, 'sync' asks the TAP sync endpoint for the result in one request, 'auto' uses sync for small queries (`TOP n` up to 10000 rows, uploads up to 500 rows) and falls back to async if it fails or takes more than `sync_timeout` seconds. Defaults to 'auto'.
+            paginate (tuple, optional): (column, min, max), e.g. ('ra', 0, 360), used to split a query whose result hits the service row limit: the range is bisected and the pages are queried in parallel and stacked. Qualify the column (e.g. 't.ra') when the query joins tables. Queries with `TOP n` are not split. If a page query fails the truncated result is returned with a warning. False only warns about the truncation, None skips the check. Defaults to False.
 
         Returns:
             astropy.table.Table: result table.
         """        
-        if self.collab:
-            baselink = f"{self.SERVER_IP}/tap/tap/async/"
-        else:
-            baselink = f"{self.SERVER_IP}/public-TAP/tap/async/"
-
-
-        if publicdata and self.collab:
-            baselink = f"{self.SERVER_IP}/public-TAP/tap/async/"
-
-        data = {
-            "request": 'doQuery',
-            "version": '1.0',
-            "lang": 'ADQL',
-            "phase": 'run',
-            "query": query,
-            "format": 'fits'
-        }
+        self._validate_token()
         
-        if str(type(table_upload)) != "<class 'NoneType'>":
-            if 'astropy.table' in str(type(table_upload)):
-                if len(table_upload) > 6000:
-                    print('Cutting to the first 6000 objects!')
-                    table_upload = table_upload[0:6000]
-                    table_upload = from_table(table_upload)
-
-                    IObytes = io.BytesIO()
-                    writeto(table_upload, IObytes)
-
-                    IObytes.seek(0)
-                else:
-                    table_upload = from_table(table_upload)
-
-                    IObytes = io.BytesIO()
-                    writeto(table_upload, IObytes)
-
-                    IObytes.seek(0)
-
-            elif 'astropy.io.votable' in str(type(table_upload)):
-                if table_upload.get_first_table().nrows > 6000:
-                    return 'votable bigger than 6000'
-                else:
-                    IObytes = io.BytesIO()
-                    writeto(table_upload, IObytes)
-                    IObytes.seek(0)
-
-            elif 'DataFrame' in str(type(table_upload)):
-                if len(table_upload) > 6000:
-                    print('Cutting to the first 6000 objects!')
-                    table_upload = table_upload[0:6000]
-                    table_upload = Table.from_pandas(table_upload)
-                    table_upload = from_table(table_upload)
-                    IObytes = io.BytesIO()
-                    writeto(table_upload, IObytes)
-                    IObytes.seek(0)
-                else:
-                    table_upload = Table.from_pandas(table_upload)
-                    table_upload = from_table(table_upload)
-                    IObytes = io.BytesIO()
-                    writeto(table_upload, IObytes)
-                    IObytes.seek(0)
-                    
-
+        if chunked and table_upload is not None:
+            if filename is not None or stream or return_type != 'table':
+                raise ValueError("chunked queries stack the chunk results in memory, filename, stream and return_type can't be used")
+            return self._query_chunked(query, table_upload, publicdata, max_jobs, mode, paginate)
+        
+        result, cached = self._query_once(query, table_upload, publicdata, filename, stream, return_type, mode)
+        
+        # A cached result was checked (warned about) when it was downloaded, only pagination needs the check again
+        if paginate is not None and (paginate or not cached) and self._overflowed(result, query, publicdata):
+            if paginate and filename is None and not stream and not re.search(r'\btop\s+\d+', query, re.IGNORECASE):
+                result = self._query_paginated(query, table_upload, publicdata, mode, paginate, max_jobs, result)
             else:
-                return 'Table type not supported'
-
+                warnings.warn(f"Query result truncated at the service row limit ({len(result)} rows)")
+            self.lastcontent = result
+        
+        return result
+    
+    def _query_once(self, query, table_upload, publicdata, filename, stream, return_type, mode):
+        """Runs one query, from the query cache, the sync endpoint or an async job. Returns (result, True if from the cache)."""
+        from xml.dom import minidom
+        
+        baselink = _tap_async_link(self.SERVER_IP, self.collab, publicdata)
+        data = _query_payload(query)
+        
+        IObytes = None
+        if table_upload is not None:
+            IObytes = _upload_bytes(table_upload, query)
+            if isinstance(IObytes, str):
+                return IObytes, False
+        
+        cache_key = None
+        if self.query_cache is not None:
+            cache_key = self.query_cache.key(query, baselink, IObytes.getvalue() if IObytes is not None else None)
+            path = self.query_cache.get(cache_key)
+            if path is not None:
+                result = self._read_result(path, filename, stream, return_type)
+                self.lastres = 'query'
+                self.lastcontent = result
+                return result, True
+        
+        if mode not in ('auto', 'sync', 'async'):
+            raise ValueError("mode must be 'auto', 'sync' or 'async'")
+        
+        if mode == 'sync' or (mode == 'auto' and _is_small_query(query, _table_rows(table_upload) if table_upload is not None else None)):
+            result = self._query_sync(query, publicdata, IObytes, filename, stream, return_type, cache_key, fallback=mode == 'auto')
+            if result is not None or mode == 'sync':
+                return result, False
+            if IObytes is not None:
+                IObytes.seek(0)
+        
+        if IObytes is not None:
             data['upload'] = 'upload,param:uplTable'
-            res = requests.post(baselink , data = data, headers=self.headers, files={'uplTable': IObytes.read()})
-
-        if not table_upload:
-            res = requests.post(baselink , data = data, headers=self.headers)
+            res = self.session.post(baselink , data = data, headers=self.headers, files={'uplTable': ('uplTable.xml', IObytes)})
+        else:
+            res = self.session.post(baselink , data = data, headers=self.headers)
 
         xmldoc = minidom.parse(io.BytesIO(res.content))
 
         try:
-            item = xmldoc.getElementsByTagName('phase')[0]
-            process = item.firstChild.data
+            process = _xml_text(xmldoc, 'phase')
+            jobID = _xml_text(xmldoc, 'jobId')
 
-            item = xmldoc.getElementsByTagName('jobId')[0]
-            jobID = item.firstChild.data
+            if process in _RUNNING_PHASES:
+                xmldoc = self._wait_job(baselink + jobID, process)
+                process = _xml_text(xmldoc, 'phase')
 
-            while process == 'EXECUTING':
-                res = requests.get(baselink + jobID, headers=self.headers)
+            if process == 'COMPLETED':
+                link = _result_link(xmldoc, self.SERVER_IP)
+                res = self._send('GET', link, stream=filename is not None or stream)
+                return self._load_result(res, filename, stream, return_type, cache_key), False
+
+            if process == 'ERROR':
+                print("Error: ", _xml_text(xmldoc, 'message'))
+
+        except:
+            _print_votable_info(xmldoc)
+        return None, False
+    
+    def _query_sync(self, query, publicdata, IObytes, filename, stream, return_type, cache_key, fallback):
+        """
+        Runs a query on the TAP sync endpoint. Returns None when it failed or timed out, for the 
+        caller to fall back to an async job (errors are printed unless `fallback` is set).
+        """
+        from xml.dom import minidom
+        
+        data = _query_payload(query)
+        del data['phase']
+        files = None
+        if IObytes is not None:
+            data['upload'] = 'upload,param:uplTable'
+            files = {'uplTable': ('uplTable.xml', IObytes)}
+        
+        # The body is read under the same timeout, a slow or broken transfer falls back too
+        try:
+            res = self.session.post(_tap_sync_link(self.SERVER_IP, self.collab, publicdata), data=data, files=files, 
+                                    headers=self.headers, timeout=self.sync_timeout, stream=True)
+            if res.status_code == 200 and 'fits' in res.headers.get('Content-Type', ''):
+                return self._load_result(res, filename, stream, return_type, cache_key)
+            
+            # Errors come back as a VOTable with the message in an INFO element
+            content = res.content
+        except requests.RequestException as e:
+            if not fallback:
+                print("Error: sync query failed:", e)
+            return None
+        
+        if not fallback:
+            try:
+                _print_votable_info(minidom.parse(io.BytesIO(content)))
+            except Exception:
+                print("Error: ", res.status_code, content[:200])
+        return None
+    
+    def _load_result(self, res, filename, stream, return_type, cache_key):
+        """Reads (or streams to disk) a FITS result response, storing it in the query cache."""
+        from astropy.table import Table
+        
+        # `query_many` runs queries from many threads: the result is kept local, lastcontent is only a record
+        if filename is not None or stream:
+            res.raise_for_status()
+            path = _stream_to_file(res, filename or _temp_filename('.fits'))
+            if cache_key is not None:
+                self.query_cache.put(cache_key, source=path)
+            result = _open_result(path, return_type)
+            if filename is None:
+                _remove_when_released(result, path)
+        else:
+            result = Table.read(io.BytesIO(res.content))
+            if cache_key is not None:
+                self.query_cache.put(cache_key, res.content)
+        
+        self.lastres = 'query'
+        self.lastcontent = result
+        return result
+    
+    @staticmethod
+    def _read_result(path, filename=None, stream=False, return_type='table'):
+        """Opens a cached result the way `query` returns a downloaded one."""
+        from astropy.table import Table
+        
+        if filename is not None:
+            shutil.copyfile(path, filename)
+            return _open_result(filename, return_type)
+        if stream:
+            return _open_result(path, return_type)
+        return Table.read(path, format='fits', memmap=False)
+    
+    def _output_limit(self, publicdata):
+        """
+        Default row limit of the TAP service, read once from its capabilities. None if unknown.
+        A single short request without retries, it must not slow down the query it checks.
+        """
+        from xml.dom import minidom
+        
+        link = _tap_async_link(self.SERVER_IP, self.collab, publicdata)[:-len("async/")] + "capabilities"
+        if link not in self._output_limits:
+            limit = None
+            try:
+                res = self.session.get(link, headers=self.headers, timeout=CAPABILITIES_TIMEOUT)
                 xmldoc = minidom.parse(io.BytesIO(res.content))
+                for element in xmldoc.getElementsByTagName('outputLimit'):
+                    default = element.getElementsByTagName('default')[0]
+                    if default.getAttribute('unit') in ('', 'row'):
+                        limit = int(default.firstChild.data)
+            except Exception:
+                pass
+            self._output_limits[link] = limit
+        return self._output_limits[link]
+    
+    def _overflowed(self, result, query, publicdata):
+        """True if a result table was cut by the service row limit."""
+        if result is None or isinstance(result, str) or not hasattr(result, 'meta'):
+            return False
+        
+        # An overflow INFO carried into the table metadata
+        if any('OVERFLOW' in str(value).upper() for value in result.meta.values()):
+            return True
+        
+        if len(result) == 0:
+            return False
+        limit = self._output_limit(publicdata)
+        if limit is None or len(result) < limit:
+            return False
+        top = re.search(r'\btop\s+(\d+)', query, re.IGNORECASE)
+        return not (top and int(top.group(1)) <= limit)
+    
+    def _query_paginated(self, query, table_upload, publicdata, mode, paginate, max_jobs, truncated):
+        """Splits the range of a column until no page overflows, querying the pages in parallel."""
+        from astropy.table import vstack
+        
+        column, low, high = paginate
+        if len(re.findall(r'\bwhere\b', _strip_comments(query), re.IGNORECASE)) > 1 or re.search(r'\b(order|group)\s+by\b', query, re.IGNORECASE):
+            warnings.warn(f"Query result truncated at the service row limit ({len(truncated)} rows), "
+                          "queries with subqueries, GROUP BY or ORDER BY are not paginated")
+            return truncated
+        
+        pages = {}
+        ranges = [(low, (low + high) / 2), ((low + high) / 2, high)]
+        while ranges:
+            queries = [
+                {"query": _add_predicate(query, _range_predicate(column, start, end, end == high)), 
+                 "table_upload": table_upload, "mode": mode, "paginate": None}
+                for start, end in ranges
+            ]
+            split = []
+            for item in self.query_many(queries, max_jobs=max_jobs, publicdata=publicdata):
+                start, end = ranges[item["index"]]
+                if item["error"] is not None:
+                    warnings.warn(f"Query result truncated at the service row limit ({len(truncated)} rows), "
+                                  f"paginating it failed on page {column} in [{start}, {end}]: {item['error']}")
+                    return truncated
+                
+                # At most 4096 pages, a range that can't be split further is kept truncated
+                if self._overflowed(item["data"], item["query"], publicdata) and end - start > (high - low) / 4096:
+                    split += [(start, (start + end) / 2), ((start + end) / 2, end)]
+                else:
+                    if self._overflowed(item["data"], item["query"], publicdata):
+                        warnings.warn(f"Page {column} in [{start}, {end}] still truncated at the service row limit")
+                    pages[start] = item["data"]
+            ranges = split
+        
+        self.lastres = 'query'
+        return vstack([pages[start] for start in sorted(pages)], metadata_conflicts='silent')
+    
+    def _query_chunked(self, query, table_upload, publicdata, max_jobs, mode='auto', paginate=False):
+        """Runs `query` once per upload chunk, in parallel, and stacks the results in the chunk order."""
+        from astropy.table import vstack
+        
+        chunks = _split_upload(table_upload)
+        if len(chunks) <= 1:
+            return self.query(query, table_upload, publicdata, mode=mode, paginate=paginate)
+        
+        queries = [{"query": query, "table_upload": chunk, "mode": mode, "paginate": paginate} for chunk in chunks]
+        
+        results = [None] * len(chunks)
+        for item in self.query_many(queries, max_jobs=max_jobs, publicdata=publicdata):
+            if item["error"] is not None:
+                raise SplusError(f"Query failed on upload chunk {item['index']}: {item['error']}")
+            results[item["index"]] = item["data"]
+        
+        result = vstack(results, metadata_conflicts='silent')
+        self.lastres = 'query'
+        self.lastcontent = result
+        return result
+    
+    def _wait_job(self, joblink, phase):
+        """
+        Polls an UWS job until it leaves the running phases and returns its last xml document.
+        
+        Polling starts every `poll_interval` seconds and backs off up to `refresh_rate`, see `_JobPoller`.
+        """
+        poller = _JobPoller(phase, self.poll_interval, self.refresh_rate)
+        while True:
+            start = time.monotonic()
+            res = self._send('GET', joblink, params=poller.params())
+            if poller.update(res.content, time.monotonic() - start):
+                return poller.xmldoc
+            time.sleep(poller.sleep)
+    
+    def query_many(self, queries, max_jobs=4, publicdata=None):
+        """Runs many queries at once on the TAP service, keeping at most `max_jobs` jobs on the server.
 
-                item = xmldoc.getElementsByTagName('phase')[0]
-                process = item.firstChild.data
-                time.sleep(self.refresh_rate)
+        Args:
+            queries (list): queries, as ADQL strings or as dicts of `query` arguments (query, table_upload, publicdata).
+            max_jobs (int, optional): maximum number of jobs running at the same time, keep it under the server job quota. Defaults to 4.
+            publicdata (bool, optional): If internal wants to access public data. Defaults to None.
 
-            if process == 'COMPLETED':
-                item = xmldoc.getElementsByTagName('result')[0]
-                link = item.attributes['xlink:href'].value
+        Yields:
+            dict: as each query finishes, with keys 'index' (position in `queries`), 'query', 'data' (astropy.table.Table or None) and 'error' (Exception or None).
+        """
+        self._validate_token()
+        
+        def _run(index, query):
+            kwargs = dict(query) if isinstance(query, dict) else {"query": query}
+            kwargs.setdefault("publicdata", publicdata)
+            
+            item = {"index": index, "query": kwargs["query"], "data": None, "error": None}
+            try:
+                result = self.query(**kwargs)
+                if result is None or isinstance(result, str):
+                    raise SplusError(result or "Query failed")
+                item["data"] = result
+            except Exception as e:
+                item["error"] = e
+            return item
+        
+        self._ensure_pool_size(max_jobs)
+        with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+            futures = [executor.submit(_run, index, query) for index, query in enumerate(queries)]
+            for future in as_completed(futures):
+                yield future.result()
+    
+    def query_tiled(self, adql_template, output, tiling='healpix', workers=4, publicdata=None, nside=8, ra_col='ra', dec_col='dec', field_col='field', fields=None):
+        """Runs a survey wide query tile by tile and writes the results to a parquet dataset.
 
-                link = link.replace("http://192.168.10.23:8080", f"{self.SERVER_IP}").replace("http://10.180.0.209:8080", f"{self.SERVER_IP}").replace("http://10.180.0.207:8080", f"{self.SERVER_IP}").replace("http://10.180.0.219:8080", f"{self.SERVER_IP}")
-                res = requests.get(link, headers=self.headers)
-                
-                self.lastres = 'query'
-                self.lastcontent = Table.read(io.BytesIO(res.content))
-                
-                return self.lastcontent
+        The sky is split in HEALPix pixels or in S-PLUS fields. Each tile runs its own job, and its 
+        result is written to `output/tile=<name>/part-0.parquet` as soon as it arrives, so only 
+        `workers` tiles are held in memory. Tiles already written are skipped, so a failed or 
+        interrupted run continues where it stopped when called again.
 
-            if process == 'ERROR':
-                item = xmldoc.getElementsByTagName('message')[0]
-                message = item.firstChild.data
+        Args:
+            adql_template (str): query with a `{region}` placeholder, replaced by the tile predicate, e.g. "SELECT * FROM idr4_dual.idr4_dual_r WHERE {region}". `{tile}` (and `{field}` for field tiles) can also be used.
+            output (str): folder of the parquet dataset, readable with `pandas.read_parquet(output)`.
+            tiling (str, optional): 'healpix' or 'field'. Defaults to 'healpix'.
+            workers (int, optional): tiles queried at the same time. Defaults to 4.
+            publicdata (bool, optional): If internal wants to access public data. Defaults to None.
+            nside (int, optional): HEALPix nside of the tiles. Defaults to 8.
+            ra_col (str, optional): RA column, used by HEALPix tiles. Defaults to 'ra'.
+            dec_col (str, optional): DEC column, used by HEALPix tiles. Defaults to 'dec'.
+            field_col (str, optional): field column, used by field tiles. Defaults to 'field'.
+            fields (list, optional): fields to query with field tiles. Defaults to the whole footprint.
 
-                print("Error: ", message)
+        Raises:
+            SplusError: if some tiles failed, after every other tile is written. A tile whose result hits the service row limit counts as failed and is not written, query it again with a larger `nside`.
 
-        except:
-            item = xmldoc.getElementsByTagName('INFO')
-            print(item[0].attributes['value'].value, ": ", item[0].firstChild.data)
+        Returns:
+            str: the output folder.
+        """
+        from splusdata.features.tiling import HealpixTiling, FieldTiling, tile_path, write_tile
+        
+        if tiling == 'healpix':
+            tiler = HealpixTiling(nside=nside, ra_col=ra_col, dec_col=dec_col)
+        elif tiling == 'field':
+            tiler = FieldTiling(fields, field_col=field_col, conn=self)
+        else:
+            raise ValueError("tiling must be 'healpix' or 'field'")
+        
+        self._validate_token()
+        
+        def _run(tile, params):
+            query = adql_template.format(**params)
+            result = self.query(query, publicdata=publicdata, paginate=None)
+            if result is None or isinstance(result, str):
+                raise SplusError(result or "Query failed")
+            # A truncated tile written to disk would be skipped as done by the next run
+            if self._overflowed(result, query, publicdata):
+                raise SplusError(f"Tile {tile} truncated at the service row limit ({len(result)} rows), use smaller tiles")
+            write_tile(tiler.select(tile, result), tile_path(output, tile))
+        
+        pending = [(tile, params) for tile, params in tiler.tiles() if not os.path.exists(tile_path(output, tile))]
+        
+        failed = {}
+        self._ensure_pool_size(workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_run, tile, params): tile for tile, params in pending}
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    failed[futures[future]] = future.exception()
+        
+        if failed:
+            raise SplusError(f"{len(failed)} of {len(pending)} tiles failed, run again to retry them: {failed}")
+        return output
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,14 @@
+import importlib
+
+_SUBMODULES = ("extinction", "filterbw", "footprint", "hipscat", "tiling", "zeropoints")
+
+
+def __getattr__(name):
+    # Submodules are imported on first access (PEP 562), like the names of splusdata
+    if name not in _SUBMODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return importlib.import_module(f"{__name__}.{name}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES))
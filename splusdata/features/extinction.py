@@ -8,9 +8,41 @@ import os
 try:
     from dustmaps.config import config
     import dustmaps.csfd
+except ImportError:
+    dustmaps = None
+
+try:
     import extinction
-except:
-    pass
+except ImportError:
+    extinction = None
+
+
+def ccm89_extinction(av, wavelengths, r_v=3.1, dtype=np.float32):
+    """
+    Extinction in each band for many A_V values, with the Cardelli, Clayton & Mathis (1989) law.
+
+    At fixed R_V the law is linear in A_V, so the band coefficients are computed once and the
+    result is their outer product with `av`, instead of one `extinction.ccm89` call per object.
+
+    Parameters
+    ----------
+    av : array-like of float
+        A_V of each object.
+    wavelengths : list of float
+        Wavelengths of the bands in Angstroms.
+    r_v : float, optional
+        R_V of the law, by default 3.1.
+    dtype : numpy dtype, optional
+        Type of the result, by default float32.
+
+    Returns
+    -------
+    numpy.ndarray
+        (len(av), len(wavelengths)) block of extinctions in magnitudes.
+    """
+    coeffs = extinction.ccm89(np.asarray(wavelengths, dtype=float), 1.0, r_v)
+    return np.multiply.outer(np.asarray(av, dtype=dtype), coeffs.astype(dtype))
+
 
 class SplusExtinction:
     """
@@ -100,7 +132,7 @@ class SplusExtinction:
             mask_fname=os.path.join(self.data_dir, 'csfd/mask.fits')
         )
         
-    def get_extinction(self, df, ra_col='ra', dec_col='dec'):
+    def get_extinction(self, df, ra_col='ra', dec_col='dec', dtype=np.float32):
         """
         Calculates extinction values based on RA and DEC coordinates using the CCM89 Law.
 
@@ -108,6 +140,8 @@ class SplusExtinction:
         ----------
         df : pandas.DataFrame
             DataFrame containing the coordinates with columns 'ra' and 'dec'.
+        dtype : numpy dtype, optional
+            Type of the extinction columns, by default float32.
 
         Returns
         -------
@@ -120,13 +154,9 @@ class SplusExtinction:
         av  = 3.1*ebv
 
         # Calculating the extinction on the S-PLUS bands using the Cardelli, Clayton & Mathis law.
-        lambdas = np.array(self.wavelengths).astype(float)
-
-        extinctions = []
-        for i in range(len(av)):
-            extinctions.append(extinction.ccm89(lambdas, av[i], 3.1))
+        extinctions = ccm89_extinction(av, self.wavelengths, 3.1, dtype)
         
-        extinction_df = pd.DataFrame(extinctions, columns=self.extinction_columns)
+        extinction_df = pd.DataFrame(extinctions, columns=self.extinction_columns, index=df.index)
         
         df = pd.concat([df, extinction_df], axis=1)
         
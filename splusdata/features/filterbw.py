@@ -1,230 +1,107 @@
-import math
+import collections
+import functools
+import threading
 import numpy as numpy
 from astropy.wcs import WCS
 from astropy.io import fits
 from astropy.table import Table
 import os as os
-from scipy import interpolate
 from scipy import fft
 
-##Butterworth
-def filter_bw(hdu):
-    #frequencia de corte da filtragem a ser utilizada. Para os dados do SPLUS 0.5 é um valor ótimo.
-    cutoff_frequency_x=0.5
-    cutoff_frequency_y=0.5
-
-    #ordem da filtragem, para os dados do SPLUS a melhor ordem é 1. Se usar 2, começam a surgir anéis.
-    order=1.0
-
-    #formato do filtro, não mudar. Para SPLUS elipse2= yes
-    elipse='no'
-    elipse2='yes'
-    elipsevssquare='no'
-
-    #tamanho dos pixels
-    CDELT1=0.55
-    CDELT2=0.55
-
-    try:
-        data=hdu[0].data
-        if data == None:
-            data=hdu[1].data
-    except:
-        data=hdu[1].data
-    
-    #y-eixo vertical da imagem
-    #-eixo horizontal da imagem
-
-    y,x =data.shape
-
-
-    #imagem zerada com tamanho maior do que o original, ela recebe a informação da imagem original
-    imagemzero=numpy.zeros((y+6,x+6))
-
-    for i in range(0,x):
-        for j in range(0,y):
-            imagemzero[3+j,3+i]=data[j,i]
-
-    #replicação da informação da imagem nas bordas(borda esquerda do cubo)
-
-    for i in range(0,3):
-        for j in range(0,y):
-            imagemzero[3+j,i]=data[j,0]
-
-    #replicação da informação da imagem nas bordas(borda direita do cubo)
-
-    for i in range(0,3):
-        for j in range(0,y):
-            imagemzero[3+j,3+x+i]=data[j,x-1]
-
-    #replicação da  informação da imagem nas bordas(borda de baixo do cubo)
-
-    for i in range(0,x):
-        for j in range(0,3):
-            imagemzero[j,3+i]=data[0,i]
-
-    #replicação da  informação da imagem nas bordas(borda de cima do cubo)
-
-    for i in range(0,x):
-        for j in range(0,3):
-            imagemzero[3+y+j,3+i]= data[y-1,i]
-
-    #sobrou os 4 cantos da imagem com zeros, precisamos preenche-los.
-
-    #canto inferior esquerdo
-    for i in range(0,3):
-        for j in range(0,3):
-            imagemzero[j,i]=imagemzero[j,3]
-
-    #canto inferior direito
-    for i in range(0,3):
-        for j in range(0,3):
-            imagemzero[j,3+i+x]=imagemzero[j,3+x-1]
-
-    #canto superior esquerdo
-    for i in range (0,3):
-        for j in range(0,3):
-            imagemzero[3+y+j,i]=imagemzero[3+y+j,3]
-
-    #canto superior direito
-    for i in range(0,3):
-        for j in range(0,3):
-            imagemzero[3+y+j,3+x+i]=imagemzero[3+y+j,3+x-1]
-
-    y1,x1=imagemzero.shape
-
-    #cria uma imagem maior com bordas zeradas mas com a imagemzero no meio (segunda ampliação do cubo)
-    imagemfinalexpandida=numpy.zeros((y1+30,x1+30))
-    imagemfinalexpandida[15:y1+15,15:x1+15]=imagemzero
-
-    interpol_values=numpy.zeros((2,2))
-    interpol_values1=numpy.zeros((2,2))
-    interpol_values2=numpy.zeros((2,2))
-    interpol_values3=numpy.zeros((2,2))
-
-    temporary_column=numpy.zeros((y1+2,2))
-    temporary_column[y1+1,0]=y1+30
-    temporary_column[1:y1+1,0]=range(15,y1+15)
-
-    #as bordas desta imagem devem ter valores caindo para zero.
-
-    interpol_values[1,0]=15
-    for i in range(15,x1+30):
-        interpol_values[1,1]=imagemfinalexpandida[15,i]
-        interpolate_function=interpolate.interp1d(interpol_values[0:2,0],interpol_values[0:2,1], kind='linear')
-        imagemfinalexpandida[0:16,i]=interpolate_function(numpy.arange(16))
-
-    interpol_values1[0,0]=y1+15-1
-    interpol_values1[1,0]=y1+30
-    interpol_values1[1,1]=0.0
-    for i in range(15,x1+30):
-        interpol_values1[0,1]=imagemfinalexpandida[y1+15-1,i]
-        interpolate_function1=interpolate.interp1d(interpol_values1[0:2,0],interpol_values1[0:2,1], kind='linear')
-        imagemfinalexpandida[y1+15-1:y1+30,i]=interpolate_function1(y1+15-1+numpy.arange(16))
-
-    interpol_values2[0,0]=0.0
-    interpol_values2[1,0]=15
-    interpol_values2[0,1]=0.0
-    for j in range(0,y1+30):
-        interpol_values2[1,1]=imagemfinalexpandida[j,15]
-        interpolate_function2=interpolate.interp1d(interpol_values2[0:2,0],interpol_values2[0:2,1], kind='linear')
-        imagemfinalexpandida[j,0:16]=interpolate_function2(numpy.arange(16))
-
-    interpol_values3[0,0]=x1+15-1
-    interpol_values3[1,0]=x1+30
-    interpol_values3[1,1]=0.0
-    for j in range(0, y1+30):
-        interpol_values3[0,1]=imagemfinalexpandida[j,x1+15-1]
-        interpolate_function3=interpolate.interp1d(interpol_values3[0:2,0],interpol_values3[0:2,1], kind='linear')
-        imagemfinalexpandida[j,x1+15-1:x1+30]=interpolate_function3(x1+15-1+numpy.arange(16))
+#tamanho das bordas: 3 pixels replicados + 15 pixels caindo para zero
+EDGE_PAD=3
+RAMP=15
+CROP=EDGE_PAD+RAMP
+
+
+def _image_data(hdu):
+    #a imagem fica na segunda HDU (imagens .fz), ou na primaria se for a unica
+    if len(hdu) > 1:
+        return hdu[1].data
+    return hdu[0].data
+
+
+def _expand(data, dtype=float):
+    """
+    Pads the image like the reference implementation: 3 edge replicated pixels, then 15 pixels
+    on each side ramping linearly down to zero (top and bottom first, then left and right).
+    Works on the last two axes, so a cube of images is padded at once.
+    """
+    data=numpy.asarray(data, dtype=dtype)
+    largura=[(0,0)]*(data.ndim-2)+[(EDGE_PAD,EDGE_PAD)]*2
+    imagemzero=numpy.pad(data, largura, mode='edge')
+    y1,x1=imagemzero.shape[-2:]
+
+    expandida=numpy.zeros(imagemzero.shape[:-2]+(y1+2*RAMP,x1+2*RAMP), dtype=dtype)
+    expandida[...,RAMP:y1+RAMP,RAMP:x1+RAMP]=imagemzero
+
+    #rampas com os mesmos pesos da interpolacao linear (interp1d) da versao original
+    k=numpy.arange(RAMP+1, dtype=dtype)
+    topo=expandida[...,RAMP:RAMP+1,RAMP:]
+    expandida[...,0:RAMP+1,RAMP:]=(topo/RAMP)*k[:,None]
+    base=expandida[...,y1+RAMP-1:y1+RAMP,RAMP:].copy()
+    expandida[...,y1+RAMP-1:y1+2*RAMP,RAMP:]=((0.0-base)/(RAMP+1))*k[:,None]+base
+
+    esquerda=expandida[...,:,RAMP:RAMP+1].copy()
+    expandida[...,:,0:RAMP+1]=(esquerda/RAMP)*k
+    direita=expandida[...,:,x1+RAMP-1:x1+RAMP].copy()
+    expandida[...,:,x1+RAMP-1:x1+2*RAMP]=((0.0-direita)/(RAMP+1))*k+direita
+    return expandida
+
+
+#memoria maxima dos filtros guardados: um frame inteiro (~1 GB de filtro) nao fica preso apos a chamada
+KERNEL_CACHE_BYTES=256*1024**2
+_kernels=collections.OrderedDict()
+_kernels_lock=threading.Lock()
+
+
+def _butterworth_kernel(shape, cutoff_frequency_x=0.5, cutoff_frequency_y=0.5, order=1.0, dtype=numpy.float64):
+    """
+    Squared separable Butterworth filter on the (2*yf, 2*xf) Fourier grid of an expanded image of
+    `shape`, with the zero frequency at [0, 0] (the fftshift of the centered filter). Only the
+    xf+1 columns used by a real FFT are kept; the filter is even, so they hold all of it.
+
+    Kernels are cached per arguments, least recently used first out, up to KERNEL_CACHE_BYTES
+    in total; larger ones are built on every call. The returned array is read only.
+    """
+    chave=(tuple(shape), cutoff_frequency_x, cutoff_frequency_y, order, dtype)
+    with _kernels_lock:
+        filtro=_kernels.get(chave)
+        if filtro is not None:
+            _kernels.move_to_end(chave)
+            return filtro
+
+    filtro=_build_kernel(shape, cutoff_frequency_x, cutoff_frequency_y, order, dtype)
+    if filtro.nbytes<=KERNEL_CACHE_BYTES:
+        with _kernels_lock:
+            _kernels[chave]=filtro
+            while sum(k.nbytes for k in _kernels.values())>KERNEL_CACHE_BYTES:
+                _kernels.popitem(last=False)
+    return filtro
+
+
+def _build_kernel(shape, cutoff_frequency_x, cutoff_frequency_y, order, dtype):
+    yf,xf=shape
+    exporder=2.0*order
 
-    yf,xf= imagemfinalexpandida.shape
+    i=numpy.abs(numpy.arange(2*xf)-xf)/(cutoff_frequency_x*xf)
+    j=numpy.abs(numpy.arange(2*yf)-yf)/(cutoff_frequency_y*yf)
+    filtro=(1.0/(1.0+j**exporder))[:,None]*(1.0/(1.0+i**exporder))[None,:]
+    filtro=fft.ifftshift(filtro*filtro)[:,:xf+1].astype(dtype)
+    filtro.setflags(write=False)
+    return filtro
 
-    #criar o filtro com o dobro do tamanho do imagemfinalexpandida (que vai ser o tamanho da transformada de fourier)
-    filtro=numpy.zeros((2*yf,2*xf))
 
-    aa=cutoff_frequency_x*xf
-    bb=cutoff_frequency_y*yf
-    cc=cutoff_frequency_x*xf
-    dd=cutoff_frequency_y*yf
+def _filter_expanded(expandida, filtro, workers=None):
+    yf,xf=expandida.shape[-2:]
+    twodfft=fft.rfft2(expandida, s=(2*yf,2*xf), axes=(-2,-1), workers=workers)
+    twodfft*=filtro
+    invfft=fft.irfft2(twodfft, s=(2*yf,2*xf), axes=(-2,-1), workers=workers)
+    #copia, para nao manter a grade inteira da transformada na memoria
+    return numpy.ascontiguousarray(invfft[...,CROP:yf-CROP,CROP:xf-CROP])
 
-    exporder=2.0*order
 
-    imfilter1=filtro
-    xm=xf
-    ym=yf
-
-    for i in range(0,2*xf):
-        for j in range(0,2*yf):
-            conta= math.sqrt(((i-xm)/aa)**2+((j-ym)/bb)**2)
-            imfilter1[j,i]=1.0/(1.0+conta**exporder)
-
-    imfilter2=filtro
-    for i in range(0,2*xf):
-        for j in range(0,2*yf):
-            conta1=abs(i-xm)/cc
-            conta2=abs(j-ym)/dd
-            imfilter2[j,i]=(1.0/(1.0+conta1**exporder))*(1.0/(1.0+conta2**exporder))
-
-    #define o filtro final (baseando-se no seu formato)        
-    if elipse == 'yes':
-        filtro=imfilter1
-    elif elipse2 == 'yes':
-        filtro=imfilter1*imfilter1
-    elif elipsevssquare == 'yes':
-        filtro=imfilter1*imfilter2
-
-    #imagem que vai receber a filtragem
-    imagemsaida=imagemfinalexpandida
-    npadd=numpy.zeros((2*yf,2*xf))
-
-
-    #faz a filtragem
-
-    imagein=imagemfinalexpandida[0:yf,0:xf]
-    imageflag=npadd
-        #padding - procedimento de multiplicar certos pixels da imagem por -1, para que a transformada de Fourier fique com
-        #frequência = 0 no centro.
-        #faz o  padding para cada imagem
-    for i in range(0,2*xf):
-        for j in range(0,2*yf):
-            if (i<=xf-1) and (j > yf-1):
-                if((i+j)%2) != 0:
-                    flag=1
-                else:
-                    flag=-1
-                imageflag[j,i]=flag*imagein[j-yf,i]
-            else:
-                imageflag[j,i]=0.0
-
-    #faz a transformada de fourier
-    twodfft=fft.fft2(imageflag)
-    #multiplica pelo filtro
-    filtragem=twodfft*filtro
-    #faz a transformada de fourier inversa
-    twodifft=fft.ifft2(filtragem)
-    invfft=numpy.real(twodifft)
-    paddout=npadd
-    imageout=imagein
-
-    #remove o padding
-    for i in range(0,2*xf):
-        for j in range(0,2*yf):
-            if((i+j)%2) != 0:
-                flag=1
-            else:
-                flag=-1
-            paddout[j,i]=flag*invfft[j,i]
-            if (i<=xf-1) and (j >yf-1):
-                imageout[j-yf,i]=paddout[j,i]
-    imagemsaida[0:yf,0:xf]=imageout
-
-
-    #cria a imagem final, cortando a imagem filtrada (tirando as bordas)
-    imagemsaida_final=numpy.zeros((y,x))
-    imagemsaida_final=imagemsaida[18:yf-18,18:xf-18]
-
-    #header
+def _output_hdul(hdu, imagemsaida_final):
     header=hdu[0].header
     new_hdu = fits.PrimaryHDU()
     new_hdu.header=header
@@ -233,6 +110,304 @@ def filter_bw(hdu):
     new_hdu.header.set('CDELT1',0.55)
     new_hdu.header.set('CDELT2',0.55)
     new_hdu.verify('fix')
-    hdul = fits.HDUList([new_hdu, image_hdu])
-    
-    return hdul
\ No newline at end of file
+    return fits.HDUList([new_hdu, image_hdu])
+
+
+##Butterworth
+def filter_bw(hdu, dtype=numpy.float32, workers=None):
+    """
+    Butterworth low pass filter tuned for S-PLUS images (cutoff 0.5, order 1, squared separable filter).
+
+    The image is padded (edge replication and a ramp to zero), filtered in the Fourier domain
+    on a grid twice its size and cropped back to its original shape. The filter of each image
+    shape is built once and cached.
+
+    Parameters
+    ----------
+    hdu : astropy.io.fits.HDUList
+        Image, in the second HDU (or the first if it is the only one).
+    dtype : numpy dtype, optional
+        Precision of the computation and of the output, by default float32. Use float64 to match
+        the original implementation to rounding errors.
+    workers : int, optional
+        Threads used by scipy.fft, by default 1. -1 uses all cores.
+
+    Returns
+    -------
+    astropy.io.fits.HDUList
+        Primary HDU with the header of `hdu[0]` and an image HDU with the filtered image.
+    """
+    expandida=_expand(_image_data(hdu), dtype)
+    filtro=_butterworth_kernel(expandida.shape[-2:], dtype=numpy.dtype(dtype).type)
+    return _output_hdul(hdu, _filter_expanded(expandida, filtro, workers))
+
+
+def _filter_cube(cube, dtype, workers=None, batch_size=16):
+    """Filters a (n, y, x) cube, `batch_size` images per batched FFT to bound the memory."""
+    saida=numpy.empty(cube.shape, dtype=dtype)
+    for inicio in range(0, len(cube), batch_size):
+        expandida=_expand(cube[inicio:inicio+batch_size], dtype)
+        filtro=_butterworth_kernel(expandida.shape[-2:], dtype=numpy.dtype(dtype).type)
+        saida[inicio:inicio+batch_size]=_filter_expanded(expandida, filtro, workers)
+    return saida
+
+
+def _filter_shared(entrada, saida, shape, dtype, inicio, fim, batch_size):
+    #processo do pool: le e escreve direto nos blocos de memoria compartilhada
+    from multiprocessing import shared_memory
+
+    bloco_entrada=shared_memory.SharedMemory(name=entrada)
+    bloco_saida=shared_memory.SharedMemory(name=saida)
+    try:
+        cube=numpy.ndarray(shape, dtype=dtype, buffer=bloco_entrada.buf)
+        out=numpy.ndarray(shape, dtype=dtype, buffer=bloco_saida.buf)
+        out[inicio:fim]=_filter_cube(cube[inicio:fim], dtype, batch_size=batch_size)
+        del cube, out
+    finally:
+        bloco_entrada.close()
+        bloco_saida.close()
+
+
+def filter_bw_batch(arrays_or_hdus, n_jobs=1, dtype=numpy.float32, workers=None, batch_size=16):
+    """
+    Applies `filter_bw` to many same sized images at once, e.g. the 12 bands of a stamp.
+
+    Images are filtered with batched FFTs over the last two axes. With `n_jobs` > 1 the stack
+    is split between processes that read the images from, and write the results to, shared
+    memory, so nothing is pickled.
+
+    Parameters
+    ----------
+    arrays_or_hdus : numpy.ndarray or list
+        A (n, y, x) cube, or a list of 2D arrays or of HDULists (the image is read as in `filter_bw`).
+    n_jobs : int, optional
+        Number of processes, by default 1 (filter in this process).
+    dtype : numpy dtype, optional
+        Precision of the computation and of the output, by default float32.
+    workers : int, optional
+        Threads used by scipy.fft when `n_jobs` is 1.
+    batch_size : int, optional
+        Images transformed together, bounding the memory used, by default 16.
+
+    Returns
+    -------
+    cube : numpy.ndarray
+        Filtered (n, y, x) cube.
+    headers : list of astropy.io.fits.Header or None
+        For HDUList inputs, the header of each `hdu[0]` with CDELT1/CDELT2 set like `filter_bw`.
+    """
+    headers=None
+    if isinstance(arrays_or_hdus, numpy.ndarray):
+        cube=arrays_or_hdus
+    else:
+        itens=list(arrays_or_hdus)
+        if itens and isinstance(itens[0], fits.HDUList):
+            headers=[]
+            for hdu in itens:
+                header=hdu[0].header.copy()
+                header.set('CDELT1',0.55)
+                header.set('CDELT2',0.55)
+                headers.append(header)
+            itens=[_image_data(hdu) for hdu in itens]
+        shapes={numpy.shape(item) for item in itens}
+        if len(shapes) > 1:
+            raise ValueError(f"All images must have the same shape, got {sorted(shapes)}")
+        cube=numpy.stack(itens) if itens else numpy.empty((0,0,0))
+
+    if cube.ndim == 2:
+        cube=cube[None]
+    if cube.ndim != 3:
+        raise ValueError("Expected a (n, y, x) cube of images")
+
+    if n_jobs is None or n_jobs <= 1 or len(cube) <= 1:
+        return _filter_cube(cube, dtype, workers, batch_size), headers
+
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+
+    dtype=numpy.dtype(dtype)
+    tamanho=max(1, int(numpy.prod(cube.shape))*dtype.itemsize)
+    bloco_entrada=shared_memory.SharedMemory(create=True, size=tamanho)
+    bloco_saida=shared_memory.SharedMemory(create=True, size=tamanho)
+    try:
+        entrada=numpy.ndarray(cube.shape, dtype=dtype, buffer=bloco_entrada.buf)
+        entrada[:]=cube
+        del entrada
+
+        passo=-(-len(cube)//n_jobs)
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures=[
+                executor.submit(_filter_shared, bloco_entrada.name, bloco_saida.name, cube.shape, dtype.str, inicio, min(inicio+passo, len(cube)), batch_size)
+                for inicio in range(0, len(cube), passo)
+            ]
+            for future in futures:
+                future.result()
+
+        saida=numpy.ndarray(cube.shape, dtype=dtype, buffer=bloco_saida.buf).copy()
+    finally:
+        bloco_entrada.close()
+        bloco_entrada.unlink()
+        bloco_saida.close()
+        bloco_saida.unlink()
+
+    return saida, headers
+
+
+def _ramp_weights(n):
+    """Weight of each pixel of an expanded axis (original length n) in `_expand`: 0->1 ramp, ones, 1->0 ramp."""
+    n1=n+2*EDGE_PAD
+    pesos=numpy.ones(n1+2*RAMP)
+    pesos[0:RAMP+1]=numpy.arange(RAMP+1)/RAMP
+    pesos[n1+RAMP-1:]=(RAMP+1-numpy.arange(RAMP+1))/(RAMP+1)
+    return pesos
+
+
+@functools.lru_cache(maxsize=8)
+def _axis_kernel(n, margin, cutoff_frequency=0.5, order=1.0):
+    """
+    Spatial kernel, taps -margin..margin, of the filter along an axis of original length n: the
+    inverse transform of the squared Butterworth on the 2*nf grid that `filter_bw` uses.
+    """
+    nf=n+2*CROP
+    f=numpy.abs(numpy.arange(2*nf)-nf)/(cutoff_frequency*nf)
+    g=fft.ifftshift((1.0/(1.0+f**(2.0*order)))**2)
+    h=fft.irfft(g[:nf+1], n=2*nf)
+    return h[numpy.arange(-margin, margin+1)]
+
+
+@functools.lru_cache(maxsize=8)
+def _tile_kernel(shape, size, margin, dtype):
+    """Transform of the separable tile kernel, on a real FFT grid of `size` (overlap-save)."""
+    ky=numpy.zeros(size[0])
+    kx=numpy.zeros(size[1])
+    taps=numpy.arange(-margin, margin+1)
+    ky[taps]=_axis_kernel(shape[0], margin)
+    kx[taps]=_axis_kernel(shape[1], margin)
+    filtro=(fft.fft(ky)[:,None]*fft.rfft(kx)[None,:]).astype(numpy.result_type(dtype, numpy.complex64))
+    filtro.setflags(write=False)
+    return filtro
+
+
+def _expanded_block(data, linhas, colunas, pesos_y, pesos_x, dtype):
+    """Block of the expanded image (see `_expand`) for rows/columns in expanded coordinates, zero outside it."""
+    y,x=data.shape
+    dentro_y=(linhas>=0)&(linhas<len(pesos_y))
+    dentro_x=(colunas>=0)&(colunas<len(pesos_x))
+    wy=numpy.where(dentro_y, pesos_y[numpy.clip(linhas,0,len(pesos_y)-1)], 0.0)
+    wx=numpy.where(dentro_x, pesos_x[numpy.clip(colunas,0,len(pesos_x)-1)], 0.0)
+
+    #le so a janela necessaria da imagem (memmap)
+    fy=numpy.clip(linhas-CROP,0,y-1)
+    fx=numpy.clip(colunas-CROP,0,x-1)
+    janela=numpy.asarray(data[fy.min():fy.max()+1,fx.min():fx.max()+1], dtype=dtype)
+    bloco=janela[numpy.ix_(fy-fy.min(),fx-fx.min())]
+    return bloco*wy[:,None].astype(dtype)*wx[None,:].astype(dtype)
+
+
+def _create_output(path, header, shape):
+    """Writes the output FITS (primary header + image extension) without its data, and maps the data."""
+    image_header=fits.ImageHDU(data=numpy.zeros((1,1), dtype=numpy.float32)).header
+    image_header['NAXIS1']=shape[1]
+    image_header['NAXIS2']=shape[0]
+
+    primary=fits.PrimaryHDU()
+    primary.header=header
+    primary.header.set('SIMPLE',True)
+    primary.header.set('CDELT1',0.55)
+    primary.header.set('CDELT2',0.55)
+    primary.verify('fix')
+
+    partial=path+".part"
+    with open(partial, 'wb') as f:
+        primary.writeto(f)
+        f.write(image_header.tostring().encode('ascii'))
+        offset=f.tell()
+        tamanho=shape[0]*shape[1]*4
+        #completa o bloco de 2880 bytes do FITS
+        f.truncate(offset+tamanho+(-tamanho)%2880)
+    return partial, numpy.memmap(partial, dtype='>f4', mode='r+', offset=offset, shape=shape)
+
+
+def filter_bw_tiled(source, output, tile_size=2048, margin=256, n_jobs=4, dtype=numpy.float32):
+    """
+    `filter_bw` for full field frames, in bounded memory.
+
+    The frame is filtered in tiles with overlap-save: each tile of the expanded image (with the
+    same edge replication and ramps as `filter_bw`) is read with `margin` extra pixels on each
+    side and convolved with the filter kernel truncated to +-margin pixels. The input is read
+    memory mapped when possible, and the result is written tile by tile to a memory mapped FITS,
+    laid out like the `filter_bw` output. Tiles are filtered in parallel threads.
+
+    The kernel tails decay as 1/distance^2, so the result differs from `filter_bw` by about
+    1e-6 of the image peak with the default margin of 256 pixels.
+
+    Parameters
+    ----------
+    source : str, astropy.io.fits.HDUList or numpy.ndarray
+        Frame, as a FITS file (image read as in `filter_bw`), an HDUList or a 2D array.
+    output : str
+        Path of the FITS file written.
+    tile_size : int, optional
+        Side of the tiles written, by default 2048.
+    margin : int, optional
+        Overlap of the tiles, and half length of the kernel, in pixels. By default 256.
+    n_jobs : int, optional
+        Tiles filtered at the same time, by default 4.
+    dtype : numpy dtype, optional
+        Precision of the computation, by default float32. The output is float32.
+
+    Returns
+    -------
+    str
+        The output path.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    hdul=None
+    if isinstance(source, str):
+        hdul=fits.open(source, memmap=True)
+        source=hdul
+    try:
+        if isinstance(source, fits.HDUList):
+            data=_image_data(source)
+            header=source[0].header.copy()
+        else:
+            data=numpy.asarray(source)
+            header=fits.PrimaryHDU().header
+
+        y,x=data.shape
+        pesos_y=_ramp_weights(y)
+        pesos_x=_ramp_weights(x)
+
+        tamanho_fft=(fft.next_fast_len(min(tile_size,y)+2*margin, real=True),
+                     fft.next_fast_len(min(tile_size,x)+2*margin, real=True))
+        filtro=_tile_kernel((y,x), tamanho_fft, margin, numpy.dtype(dtype).type)
+
+        partial,saida=_create_output(output, header, (y,x))
+
+        def _tile(inicio_y, inicio_x):
+            fim_y=min(inicio_y+tile_size,y)
+            fim_x=min(inicio_x+tile_size,x)
+            #coordenadas na imagem expandida, com a margem
+            linhas=numpy.arange(inicio_y+CROP-margin, fim_y+CROP+margin)
+            colunas=numpy.arange(inicio_x+CROP-margin, fim_x+CROP+margin)
+            bloco=_expanded_block(data, linhas, colunas, pesos_y, pesos_x, dtype)
+
+            transformada=fft.rfft2(bloco, s=tamanho_fft)
+            transformada*=filtro
+            filtrado=fft.irfft2(transformada, s=tamanho_fft)
+            saida[inicio_y:fim_y,inicio_x:fim_x]=filtrado[margin:margin+fim_y-inicio_y,margin:margin+fim_x-inicio_x]
+
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            futures=[executor.submit(_tile, inicio_y, inicio_x)
+                     for inicio_y in range(0,y,tile_size) for inicio_x in range(0,x,tile_size)]
+            for future in futures:
+                future.result()
+
+        saida.flush()
+        del saida
+        os.replace(partial, output)
+    finally:
+        if hdul is not None:
+            hdul.close()
+    return output
@@ -0,0 +1,229 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from splusdata.cache import default_cache_dir, cached_download
+
+fields_source = "https://splus.cloud/files/documentation/iDR4/tabelas/iDR4_fields.csv"
+
+# Half of the side of a S-PLUS field, in degrees (1.4 x 1.4 deg fields).
+FIELD_HALF_SIZE = 0.7
+
+
+def _unit_vectors(ra, dec):
+    ra = np.radians(ra)
+    dec = np.radians(dec)
+    cos_dec = np.cos(dec)
+    return np.stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)], axis=-1)
+
+
+def _find_column(columns, *names):
+    lower = {col.lower(): col for col in columns}
+    for name in names:
+        if name.lower() in lower:
+            return lower[name.lower()]
+    return None
+
+
+class FootprintIndex:
+    """
+    Local index of the S-PLUS field footprints, answering `checkcoords` without the server.
+
+    Field centers are kept in a KD-tree of unit vectors. A position belongs to a field when its
+    gnomonic projection on the field center falls inside the field square. When several fields
+    contain it, the one with the closest center wins. Positions closer than `edge_tolerance` to
+    a field border are flagged as ambiguous, and only those are sent to the server when a
+    connection is given.
+
+    Parameters
+    ----------
+    fields : array-like of str
+        Field names.
+    ra, dec : array-like of float
+        Field centers in degrees.
+    public, internal : array-like of bool, optional
+        Whether each field is in the public / internal data releases.
+    half_size : float, optional
+        Half of the side of the fields in degrees, by default 0.7.
+    edge_tolerance : float, optional
+        Distance to a field border, in degrees, under which a position is ambiguous. Defaults to 0.005 (18 arcsec).
+
+    ```python
+    footprint = FootprintIndex.from_server(conn)
+    result = footprint.checkcoords(df["ra"], df["dec"], conn=conn)
+    ```
+    """
+
+    def __init__(self, fields, ra, dec, public=None, internal=None, half_size=FIELD_HALF_SIZE, edge_tolerance=0.005):
+        from scipy.spatial import cKDTree
+
+        self.fields = np.asarray(fields, dtype=object)
+        self.ra = np.asarray(ra, dtype=float)
+        self.dec = np.asarray(dec, dtype=float)
+        self.public = None if public is None else np.asarray(public, dtype=bool)
+        self.internal = None if internal is None else np.asarray(internal, dtype=bool)
+        self.half_size = half_size
+        self.edge_tolerance = edge_tolerance
+
+        self._tree = cKDTree(_unit_vectors(self.ra, self.dec))
+        # Fields overlap at most a few at a time, 8 neighbours are plenty
+        self._neighbours = min(8, len(self.fields))
+
+    def __len__(self):
+        return len(self.fields)
+
+    @classmethod
+    def from_table(cls, table, **kwargs):
+        """
+        Builds the index from a table of fields.
+
+        The table (pandas.DataFrame or astropy.table.Table) needs a field name column ('Field' or 'Name')
+        and the center columns ('RA', 'DEC'). The 'public' and 'internal' columns are used if present.
+        """
+        if not isinstance(table, pd.DataFrame):
+            table = table.to_pandas()
+
+        columns = table.columns
+        field_col = _find_column(columns, "field", "name", "fieldname")
+        ra_col = _find_column(columns, "ra", "ra_center", "ra_deg")
+        dec_col = _find_column(columns, "dec", "dec_center", "dec_deg")
+        if field_col is None or ra_col is None or dec_col is None:
+            raise ValueError("Fields table needs field name, 'ra' and 'dec' columns")
+
+        public_col = _find_column(columns, "public")
+        internal_col = _find_column(columns, "internal")
+
+        return cls(
+            table[field_col].to_numpy(),
+            table[ra_col].to_numpy(dtype=float),
+            table[dec_col].to_numpy(dtype=float),
+            public=None if public_col is None else table[public_col].to_numpy(dtype=bool),
+            internal=None if internal_col is None else table[internal_col].to_numpy(dtype=bool),
+            **kwargs,
+        )
+
+    @classmethod
+    def from_csv(cls, path, **kwargs):
+        """Builds the index from a CSV of fields, see `from_table`."""
+        return cls.from_table(pd.read_csv(path), **kwargs)
+
+    @classmethod
+    def from_server(cls, conn=None, source=fields_source, cache_dir=None, max_age=None, **kwargs):
+        """
+        Builds the index from the fields table of splus.cloud, kept on disk between sessions.
+
+        Parameters
+        ----------
+        conn : splusdata.Core, optional
+            Used for its authentication headers.
+        source : str, optional
+            URL of the fields CSV.
+        cache_dir : str, optional
+            Folder where the CSV is kept, by default ~/.cache/splusdata/footprint.
+        max_age : float, optional
+            Sync the CSV again if the local copy is older than this many seconds. By default it is kept forever.
+        """
+        path = os.path.join(cache_dir or default_cache_dir("footprint"), os.path.basename(source))
+        cached_download(source, path, max_age, headers=getattr(conn, "headers", None))
+        return cls.from_csv(path, **kwargs)
+
+    @staticmethod
+    def sync(source, path, conn=None):
+        """Downloads the fields CSV from the server to `path`."""
+        cached_download(source, path, max_age=0, headers=getattr(conn, "headers", None))
+
+    def save(self, path):
+        """Writes the fields table to a CSV readable by `from_csv`."""
+        table = pd.DataFrame({"Field": self.fields, "RA": self.ra, "DEC": self.dec})
+        if self.public is not None:
+            table["public"] = self.public
+        if self.internal is not None:
+            table["internal"] = self.internal
+        table.to_csv(path, index=False)
+
+    def _locate(self, ra, dec):
+        """Index of the field of each position (-1 if none), its distance to the center and whether it is ambiguous."""
+        n = len(ra)
+        # Farthest a position inside a field can be from its center: the half diagonal
+        radius = np.radians(np.sqrt(2) * (self.half_size + self.edge_tolerance))
+        chord = 2 * np.sin(radius / 2)
+
+        chords, candidates = self._tree.query(_unit_vectors(ra, dec), k=self._neighbours, distance_upper_bound=chord)
+        chords = chords.reshape(n, self._neighbours)
+        candidates = candidates.reshape(n, self._neighbours)
+        valid = candidates < len(self.fields)
+        candidates = np.where(valid, candidates, 0)
+
+        # Gnomonic projection of each position on each candidate center
+        ra_r, dec_r = np.radians(ra)[:, None], np.radians(dec)[:, None]
+        ra0, dec0 = np.radians(self.ra[candidates]), np.radians(self.dec[candidates])
+        cos_dra = np.cos(ra_r - ra0)
+        cos_c = np.sin(dec0) * np.sin(dec_r) + np.cos(dec0) * np.cos(dec_r) * cos_dra
+        xi = np.degrees(np.cos(dec_r) * np.sin(ra_r - ra0) / cos_c)
+        eta = np.degrees((np.cos(dec0) * np.sin(dec_r) - np.sin(dec0) * np.cos(dec_r) * cos_dra) / cos_c)
+
+        # Positive inside the field, distance to the closest border in degrees
+        margin = self.half_size - np.maximum(np.abs(xi), np.abs(eta))
+        margin = np.where(valid & (cos_c > 0), margin, -np.inf)
+        # From the chord, arccos(cos_c) loses precision at small separations
+        distance = np.degrees(2 * np.arcsin(np.minimum(np.where(valid, chords, 2) / 2, 1)))
+
+        inside = margin >= 0
+        best = np.argmin(np.where(inside, distance, np.inf), axis=1)
+        rows = np.arange(n)
+        found = inside[rows, best]
+
+        field = np.where(found, candidates[rows, best], -1)
+        ambiguous = np.any(np.abs(margin) < self.edge_tolerance, axis=1)
+        return field, np.where(found, distance[rows, best], np.nan), ambiguous
+
+    def checkcoords(self, ra, dec, conn=None):
+        """
+        Field of many positions at once.
+
+        Parameters
+        ----------
+        ra, dec : array-like of float
+            Positions in degrees.
+        conn : splusdata.Core, optional
+            If given, positions too close to a field border are checked with `conn.checkcoords`.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns 'ra', 'dec', 'field' (None outside the footprint), 'distance' (to the field center, in degrees),
+            'public', 'internal' and 'ambiguous' (True for positions near a border that were not checked on the server).
+        """
+        ra = np.atleast_1d(np.asarray(ra, dtype=float))
+        dec = np.atleast_1d(np.asarray(dec, dtype=float))
+
+        index, distance, ambiguous = self._locate(ra, dec)
+        found = index >= 0
+
+        result = pd.DataFrame({
+            "ra": ra,
+            "dec": dec,
+            "field": np.where(found, self.fields[np.maximum(index, 0)], None),
+            "distance": distance,
+            "public": np.where(found, self.public[np.maximum(index, 0)], None) if self.public is not None else None,
+            "internal": np.where(found, self.internal[np.maximum(index, 0)], None) if self.internal is not None else None,
+            "ambiguous": ambiguous,
+        })
+
+        if conn is not None:
+            for row in np.flatnonzero(ambiguous):
+                try:
+                    answer = conn.checkcoords(ra[row], dec[row])
+                except Exception:
+                    continue
+                for key in ("field", "distance", "public", "internal"):
+                    if key in answer:
+                        result.at[row, key] = answer[key]
+                result.at[row, "ambiguous"] = False
+
+        return result
+
+    def resolve(self, ra, dec, conn=None):
+        """Field name of each position (None outside the footprint), usable as a `get_zeropoints` resolver."""
+        return self.checkcoords(ra, dec, conn=conn)["field"].to_numpy()
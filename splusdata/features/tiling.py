@@ -0,0 +1,142 @@
+import os
+
+import numpy as np
+
+from splusdata.cache import atomic_path
+
+
+def _ra_range(ra):
+    """Smallest RA interval (low, high) holding all of `ra`; low is negative when it crosses RA = 0."""
+    ra = np.mod(ra, 360)
+    if ra.max() - ra.min() <= 180:
+        return ra.min(), ra.max()
+    shifted = np.where(ra > 180, ra - 360, ra)
+    return shifted.min(), shifted.max()
+
+
+def _box_predicate(ra_col, dec_col, ra_low, ra_high, dec_low, dec_high):
+    dec = f"{dec_col} BETWEEN {dec_low:.8f} AND {dec_high:.8f}"
+    if ra_high - ra_low >= 360:
+        return dec
+    if ra_low < 0:
+        ra = f"({ra_col} >= {ra_low + 360:.8f} OR {ra_col} <= {ra_high:.8f})"
+    else:
+        ra = f"{ra_col} BETWEEN {ra_low:.8f} AND {ra_high:.8f}"
+    return f"{ra} AND {dec}"
+
+
+class HealpixTiling:
+    """
+    Splits the sky in the HEALPix pixels (nested order) of a given nside.
+
+    Each tile is queried with its bounding box in RA/DEC, padded by `margin` degrees, and the
+    rows outside the pixel are dropped afterwards, so every object lands in exactly one tile.
+
+    Parameters
+    ----------
+    nside : int, optional
+        HEALPix nside, by default 8 (768 tiles of about 54 deg2).
+    ra_col, dec_col : str, optional
+        Names of the position columns in the ADQL and in the results (case insensitive there).
+    margin : float, optional
+        Padding of the bounding boxes in degrees, by default 0.01.
+    """
+
+    def __init__(self, nside=8, ra_col="ra", dec_col="dec", margin=0.01):
+        try:
+            from astropy_healpix import HEALPix
+        except ImportError:
+            raise ImportError("The 'astropy_healpix' package is required for HEALPix tiling.")
+
+        self.healpix = HEALPix(nside=nside, order="nested")
+        self.nside = nside
+        self.ra_col = ra_col
+        self.dec_col = dec_col
+        self.margin = margin
+
+    def tiles(self):
+        """Yields (tile name, format arguments of the ADQL template) for every pixel."""
+        import astropy.units as u
+
+        for pixel in range(self.healpix.npix):
+            lon, lat = self.healpix.boundaries_lonlat(pixel, step=8)
+            ra = lon.to_value(u.deg).ravel()
+            dec = lat.to_value(u.deg).ravel()
+
+            dec_low = max(-90.0, dec.min() - self.margin)
+            dec_high = min(90.0, dec.max() + self.margin)
+            if dec_high >= 90 - self.margin or dec_low <= -90 + self.margin:
+                # A pixel touching a pole may hold any RA near it
+                ra_low, ra_high = 0.0, 360.0
+            else:
+                ra_low, ra_high = _ra_range(ra)
+                ra_low, ra_high = ra_low - self.margin, ra_high + self.margin
+
+            region = _box_predicate(self.ra_col, self.dec_col, ra_low, ra_high, dec_low, dec_high)
+            yield str(pixel), {"region": region, "tile": pixel}
+
+    def select(self, tile, table):
+        """Keeps the rows of a tile result that fall in the tile pixel."""
+        import astropy.units as u
+
+        columns = {name.lower(): name for name in table.colnames}
+        ra_col = columns.get(self.ra_col.lower())
+        dec_col = columns.get(self.dec_col.lower())
+        if ra_col is None or dec_col is None:
+            raise ValueError(f"Tile result does not have columns '{self.ra_col}' and '{self.dec_col}', "
+                             "select them to split the rows between tiles")
+        if len(table) == 0:
+            return table
+        ra = np.asarray(table[ra_col], dtype=float)
+        dec = np.asarray(table[dec_col], dtype=float)
+        pixels = self.healpix.lonlat_to_healpix(ra * u.deg, dec * u.deg)
+        return table[pixels == int(tile)]
+
+
+class FieldTiling:
+    """
+    Splits the survey in its S-PLUS fields, one tile per field of the footprint.
+
+    Parameters
+    ----------
+    fields : array-like of str
+        Field names, by default the fields of `FootprintIndex.from_server(conn)`.
+    field_col : str, optional
+        Name of the field column in the ADQL, by default 'field'.
+    """
+
+    def __init__(self, fields=None, field_col="field", conn=None):
+        if fields is None:
+            from splusdata.features.footprint import FootprintIndex
+
+            fields = FootprintIndex.from_server(conn).fields
+        self.fields = [str(field) for field in fields]
+        self.field_col = field_col
+
+    def tiles(self):
+        """Yields (tile name, format arguments of the ADQL template) for every field."""
+        for field in self.fields:
+            name = field.replace("'", "''")
+            yield field, {"region": f"{self.field_col} = '{name}'", "tile": field, "field": name}
+
+    def select(self, tile, table):
+        return table
+
+
+def tile_path(output, tile):
+    """Path of the parquet file of a tile, in a hive partitioned dataset (tile=<name>/part-0.parquet)."""
+    name = str(tile).replace(os.sep, "_")
+    return os.path.join(output, f"tile={name}", "part-0.parquet")
+
+
+def write_tile(table, path):
+    """Writes an astropy Table to a parquet file, atomically, so partial files never look complete."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("The 'pyarrow' package is required to write parquet tiles.")
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with atomic_path(path) as partial:
+        pq.write_table(pa.Table.from_pandas(table.to_pandas(), preserve_index=False), partial)
@@ -1,7 +1,187 @@
+import os
+import threading
+
+import numpy as np
 import pandas as pd
 
+from splusdata.cache import default_cache_dir, cached_download
+
 source_cat = "https://splus.cloud/files/documentation/iDR4/tabelas/iDR4_zero-points.csv"
-zps = pd.read_csv(source_cat)
+
+
+def _normalize_field(field):
+    return str(field).strip().replace("-", "_").upper()
+
+
+def _band_column(band):
+    return band if band.startswith("ZP_") else "ZP_" + band
+
+
+class ZeroPointTable:
+    """
+    Zero point table of the S-PLUS fields, loaded once and indexed by field name.
+
+    The CSV is downloaded on first use and kept on disk, so later sessions read it locally.
+    Field names are normalized once ('-' -> '_', upper case) and indexed, so catalogs are
+    resolved with one vectorized lookup instead of a scan per object.
+
+    Parameters
+    ----------
+    source : str, optional
+        URL (or local path) of the zero point CSV, by default the iDR4 table.
+    cache_dir : str, optional
+        Folder where the CSV is kept, by default ~/.cache/splusdata/zeropoints.
+    max_age : float, optional
+        Download the CSV again if the local copy is older than this many seconds. By default it is kept forever.
+
+    ```python
+    table = ZeroPointTable()
+    zps = table.get_zeropoints(df["ra"], df["dec"], ["g", "r"], fields=df["field"])
+    ```
+    """
+
+    def __init__(self, source=source_cat, cache_dir=None, max_age=None):
+        self.source = source
+        self.cache_dir = cache_dir or default_cache_dir("zeropoints")
+        self.max_age = max_age
+
+        self._frame = None
+        self._index = None
+        self._lock = threading.Lock()
+
+    @property
+    def frame(self):
+        """The zero point table (pandas.DataFrame), with '-' replaced by '_' in the Field column."""
+        self.load()
+        return self._frame
+
+    @property
+    def bands(self):
+        """Names of the bands in the table."""
+        return [col[3:] for col in self.frame.columns if col.startswith("ZP_")]
+
+    def _local_path(self):
+        if os.path.exists(self.source):
+            return self.source
+
+        return cached_download(self.source, os.path.join(self.cache_dir, os.path.basename(self.source)), self.max_age)
+
+    def load(self):
+        """Reads and indexes the table, if not done yet."""
+        if self._frame is not None:
+            return self
+        with self._lock:
+            if self._frame is None:
+                frame = pd.read_csv(self._local_path())
+                frame["Field"] = frame["Field"].str.replace("-", "_")
+
+                self._index = pd.Index(frame["Field"].map(_normalize_field))
+                self._frame = frame
+        return self
+
+    def field_rows(self, fields):
+        """Row of each field in the table, -1 where the field is unknown."""
+        self.load()
+        # Normalize each distinct name once
+        codes, uniques = pd.factorize(np.asarray(fields, dtype=object))
+        normalized = [_normalize_field(field) for field in uniques]
+        rows = self._index.get_indexer(normalized)
+        return np.where(codes >= 0, rows[codes], -1)
+
+    def lookup(self, fields, bands="all"):
+        """
+        Zero points of a list of fields.
+
+        Parameters
+        ----------
+        fields : array-like of str
+            Field names, with either '-' or '_'.
+        bands : str or list of str, optional
+            Band names ('g', 'J0660' or 'ZP_g'). Defaults to all bands.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per field, with the 'Field' column and a 'ZP_<band>' column per band. Unknown fields get NaN.
+        """
+        if isinstance(bands, str):
+            bands = self.bands if bands.lower() == "all" else [bands]
+        columns = [_band_column(band) for band in bands]
+
+        missing = [col for col in columns if col not in self.frame.columns]
+        if missing:
+            raise KeyError(f"Bands not in the zero point table: {missing}")
+
+        rows = self.field_rows(fields)
+        values = self.frame[columns].to_numpy(dtype=float)
+        # Unknown fields read a NaN row appended at the end
+        values = np.vstack([values, np.full((1, len(columns)), np.nan)])
+
+        result = pd.DataFrame(values[rows], columns=columns)
+        result.insert(0, "Field", np.asarray(fields, dtype=object))
+        return result
+
+    def get_zeropoints(self, ra, dec, bands="all", conn=None, fields=None, resolver=None):
+        """
+        Zero points for whole catalogs of positions.
+
+        The field of each position is taken from `fields` if given, otherwise from `resolver`.
+        By default the fields are found offline with the `FootprintIndex` of splus.cloud, asking
+        `conn.checkcoords` only for positions near a field border. If the footprint is not
+        available, `conn.checkcoords` is called once per distinct position.
+
+        Parameters
+        ----------
+        ra, dec : array-like of float
+            Positions in degrees.
+        bands : str or list of str, optional
+            Band names. Defaults to all bands.
+        conn : object, optional
+            Connection object with a `checkcoords(ra, dec)` method.
+        fields : array-like of str, optional
+            Field of each position, when already known.
+        resolver : callable, optional
+            Function returning the field name of each position for arrays of ra and dec.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per position, with the 'Field' column and a 'ZP_<band>' column per band.
+        """
+        ra = np.atleast_1d(np.asarray(ra, dtype=float))
+        dec = np.atleast_1d(np.asarray(dec, dtype=float))
+
+        if fields is None and resolver is None:
+            try:
+                from splusdata.features.footprint import FootprintIndex
+
+                footprint = FootprintIndex.from_server(conn)
+                resolver = lambda ra, dec: footprint.resolve(ra, dec, conn=conn)
+            except Exception:
+                if conn is None:
+                    raise
+                resolver = lambda ra, dec: _checkcoords_fields(conn, ra, dec)
+
+        if fields is None:
+            fields = resolver(ra, dec)
+
+        return self.lookup(fields, bands)
+
+
+def _checkcoords_fields(conn, ra, dec):
+    coords = np.column_stack([ra, dec])
+    uniques, inverse = np.unique(coords, axis=0, return_inverse=True)
+    fields = np.array([list(conn.checkcoords(r, d).values())[0] for r, d in uniques], dtype=object)
+    return fields[inverse.ravel()]
+
+
+_default_table = ZeroPointTable()
+
+
+def get_zeropoints(ra, dec, bands="all", conn=None, fields=None, resolver=None):
+    """Zero points for whole catalogs of positions, from the iDR4 table. See `ZeroPointTable.get_zeropoints`."""
+    return _default_table.get_zeropoints(ra, dec, bands, conn=conn, fields=fields, resolver=resolver)
+
 
 def get_zeropoint(conn, ra, dec, band):
     """
@@ -16,7 +196,7 @@ def get_zeropoint(conn, ra, dec, band):
     dec : float
         Declination of the target position (in degrees).
     band : str
-        Photometric band for which to retrieve the zero point (e.g., 'g', 'r', 'i'). 
+        Photometric band for which to retrieve the zero point (e.g., 'g', 'r', 'i').
         If set to 'all', returns zero points for all bands.
 
     Returns
@@ -29,7 +209,7 @@ def get_zeropoint(conn, ra, dec, band):
     ------
     KeyError
         If the provided field or band is not found in the zero point table.
-    
+
     Examples
     --------
     >>> conn = some_connection_object()
@@ -43,16 +223,22 @@ def get_zeropoint(conn, ra, dec, band):
           Field   ZP_u   ZP_g   ZP_r  ...
     1234_56789  25.13  24.98  25.02  ...
     """
-    
+
     field =  list(conn.checkcoords(ra, dec).values())[0]
-    
-    zps["Field"] = zps["Field"].str.replace("-", "_")
-    field = field.replace("-", "_")
-    
+
+    zps = _default_table.frame
+    row = _default_table.field_rows([field])[0]
+
     if band.lower() == "all":
-        zp = zps[zps["Field"] == field]
-    else:
-        zp = zps[zps["Field"] == field]["ZP_" + band].values[0]
-    
-    return zp
-    
\ No newline at end of file
+        return zps.iloc[[row]] if row >= 0 else zps.iloc[[]]
+
+    if row < 0:
+        raise KeyError(f"Field {field} not in the zero point table")
+    return zps["ZP_" + band].values[row]
+
+
+def __getattr__(name):
+    # `zps` used to be read at import time, it is now loaded on first access.
+    if name == "zps":
+        return _default_table.frame
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -6,6 +6,8 @@ import inspect
 
 from astropy.table import Table
 
+from splusdata.features.footprint import FootprintIndex
+
 from yaml import load, dump
 try:
     from yaml import CLoader as Loader, CDumper as Dumper
@@ -126,6 +128,7 @@ def get_coordinates_col(df : pd.DataFrame):
 
 def handle_operation_type(operation_data, conn):
     checkcoords_list = []
+    checkcoords_df = None
     if isinstance(operation_data["type"], str):
         operations = [operation_data["type"]]
     elif isinstance(operation_data["type"], list):
@@ -145,6 +148,19 @@ def handle_operation_type(operation_data, conn):
 
         ra_col, dec_col = get_coordinates_col(df)
 
+        checkcoords_df = None
+        if "checkcoords" in operations:
+            # Resolve the whole file at once, only edge cases go to the server
+            try:
+                footprint = FootprintIndex.from_server(conn)
+                if footprint.public is None or footprint.internal is None:
+                    # The server answer has them, the csv must too
+                    raise ValueError("fields table has no 'public' and 'internal' columns")
+                checkcoords_df = footprint.checkcoords(df[ra_col], df[dec_col], conn=conn).drop(columns="ambiguous")
+                operations = [op for op in operations if op != "checkcoords"]
+            except Exception as e:
+                print("Footprint index not available, checking coordinates one by one:", e)
+
         for key, value in df.iterrows():
             info = operation_data
             ## Add ra and dec to info
@@ -165,6 +181,8 @@ def handle_operation_type(operation_data, conn):
 
     if len(checkcoords_list) > 0:
         checkcoords_df = pd.DataFrame(checkcoords_list)
+    if checkcoords_df is not None:
+        os.makedirs(operation_data["output_folder"], exist_ok=True)
         checkcoords_df.to_csv(os.path.join(operation_data["output_folder"], "checkcoords.csv"), index=False)
 
 
@@ -0,0 +1,316 @@
+import io
+import os
+import time
+import sqlite3
+
+from contextlib import closing
+from datetime import datetime
+
+from splusdata.cache import default_cache_dir, QueryCache
+from splusdata.core import (
+    SplusError,
+    _tap_async_link,
+    _query_payload,
+    _upload_bytes,
+    _xml_text,
+    _result_link,
+    _RUNNING_PHASES,
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    endpoint TEXT NOT NULL,
+    query TEXT NOT NULL,
+    key TEXT NOT NULL,
+    phase TEXT,
+    submitted REAL,
+    updated REAL,
+    fetched REAL,
+    creation_time TEXT,
+    start_time TEXT,
+    end_time TEXT,
+    error TEXT
+)
+"""
+
+_FINAL_PHASES = ('COMPLETED', 'ERROR', 'ABORTED', 'ARCHIVED')
+
+
+def _xml_optional(xmldoc, tag):
+    nodes = xmldoc.getElementsByTagName(tag)
+    if not nodes or nodes[0].firstChild is None:
+        return None
+    return nodes[0].firstChild.data
+
+
+def _seconds_between(start, end):
+    if not start or not end:
+        return None
+    try:
+        start = datetime.fromisoformat(start.replace("Z", "+00:00"))
+        end = datetime.fromisoformat(end.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return (end - start).total_seconds()
+
+
+class TapJobManager:
+    """
+    Submits TAP (UWS) jobs and keeps track of them in a local SQLite registry.
+
+    Every submitted job is recorded with its endpoint and ADQL, so a later session (or
+    another process) can reattach to it, wait for it, fetch its result or abort it, instead of
+    running the query again.
+
+    Parameters
+    ----------
+    conn : splusdata.Core
+        Authenticated connection used for the requests.
+    path : str, optional
+        SQLite file of the registry, by default ~/.cache/splusdata/jobs/jobs.sqlite.
+
+    ```python
+    jobs = TapJobManager(core)
+    job_id = jobs.submit("SELECT * FROM idr4_dual.idr4_dual_r WHERE r_auto < 17")
+    # ... later, maybe after a restart
+    table = jobs.fetch(job_id)
+    ```
+    """
+
+    def __init__(self, conn, path=None):
+        self.conn = conn
+        if path is None:
+            path = os.path.join(default_cache_dir("jobs"), "jobs.sqlite")
+        self.path = path
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._db() as db:
+            db.execute(_SCHEMA)
+
+    def _db(self):
+        # One connection per call, so the manager can be shared between threads and processes
+        return _Registry(self.path)
+
+    def _job(self, job_id):
+        with self._db() as db:
+            row = db.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Job {job_id} is not in the registry")
+        return row
+
+    def _update(self, job_id, xmldoc):
+        phase = _xml_text(xmldoc, 'phase')
+        error = _xml_optional(xmldoc, 'message') if phase == 'ERROR' else None
+        with self._db() as db:
+            db.execute(
+                "UPDATE jobs SET phase = ?, updated = ?, creation_time = COALESCE(?, creation_time), "
+                "start_time = COALESCE(?, start_time), end_time = COALESCE(?, end_time), error = ? WHERE job_id = ?",
+                (phase, time.time(), _xml_optional(xmldoc, 'creationTime'), _xml_optional(xmldoc, 'startTime'),
+                 _xml_optional(xmldoc, 'endTime'), error, job_id),
+            )
+        return phase
+
+    def _job_xml(self, job_id):
+        from xml.dom import minidom
+
+        job = self._job(job_id)
+        res = self.conn._send('GET', job["endpoint"] + job_id)
+        res.raise_for_status()
+        return minidom.parse(io.BytesIO(res.content))
+
+    def submit(self, query, table_upload=None, publicdata=None, reuse=True):
+        """
+        Submits a query as an async job and records it.
+
+        Parameters
+        ----------
+        query : str
+            ADQL query.
+        table_upload : pandas.DataFrame or astropy.table.Table, optional
+            Table to upload, available as tap_upload.upload.
+        publicdata : bool, optional
+            If internal wants to access public data.
+        reuse : bool, optional
+            Return the job of an identical query (same ADQL up to case and whitespace, endpoint and
+            upload) still running or completed on the server, instead of submitting it again. Defaults to True.
+
+        Returns
+        -------
+        str
+            The job id.
+        """
+        from xml.dom import minidom
+
+        self.conn._validate_token()
+        endpoint = _tap_async_link(self.conn.SERVER_IP, self.conn.collab, publicdata)
+        data = _query_payload(query)
+
+        IObytes = None
+        if table_upload is not None:
+            IObytes = _upload_bytes(table_upload, query)
+            if isinstance(IObytes, str):
+                raise SplusError(IObytes)
+        key = QueryCache.key(query, endpoint, IObytes.getvalue() if IObytes is not None else None)
+
+        if reuse:
+            job_id = self.reattach(key=key)
+            if job_id is not None:
+                return job_id
+
+        if IObytes is not None:
+            data['upload'] = 'upload,param:uplTable'
+            res = self.conn.session.post(endpoint, data=data, headers=self.conn.headers, files={'uplTable': ('uplTable.xml', IObytes)})
+        else:
+            res = self.conn.session.post(endpoint, data=data, headers=self.conn.headers)
+
+        try:
+            xmldoc = minidom.parse(io.BytesIO(res.content))
+            job_id = _xml_text(xmldoc, 'jobId')
+        except Exception:
+            raise SplusError(f"Job submission failed ({res.status_code}): {res.text[:200]}")
+
+        with self._db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, endpoint, query, key, submitted) VALUES (?, ?, ?, ?, ?)",
+                (job_id, endpoint, query, key, time.time()),
+            )
+        self._update(job_id, xmldoc)
+        return job_id
+
+    def reattach(self, query=None, publicdata=None, key=None):
+        """
+        Finds the most recent recorded job of a query (without upload) that is still alive on the server.
+
+        Returns
+        -------
+        str or None
+            The job id, or None if there is no usable job.
+        """
+        if key is None:
+            endpoint = _tap_async_link(self.conn.SERVER_IP, self.conn.collab, publicdata)
+            key = QueryCache.key(query, endpoint)
+
+        with self._db() as db:
+            rows = db.execute(
+                "SELECT job_id FROM jobs WHERE key = ? AND (phase IS NULL OR phase NOT IN ('ERROR', 'ABORTED')) "
+                "ORDER BY submitted DESC", (key,)
+            ).fetchall()
+
+        for row in rows:
+            try:
+                phase = self.phase(row["job_id"])
+            except Exception:
+                # Deleted by the server (destruction time) or unreachable
+                continue
+            if phase in _RUNNING_PHASES or phase == 'COMPLETED':
+                return row["job_id"]
+        return None
+
+    def phase(self, job_id):
+        """Asks the server for the phase of a job, recording it. Returns the phase."""
+        return self._update(job_id, self._job_xml(job_id))
+
+    def wait(self, job_id):
+        """Polls a job until it finishes. Returns its final phase."""
+        job = self._job(job_id)
+        xmldoc = self._job_xml(job_id)
+        phase = _xml_text(xmldoc, 'phase')
+        if phase in _RUNNING_PHASES:
+            xmldoc = self.conn._wait_job(job["endpoint"] + job_id, phase)
+        return self._update(job_id, xmldoc)
+
+    def fetch(self, job_id, filename=None, stream=False, return_type='table'):
+        """
+        Waits for a job and downloads its result, see `Core.query` for `filename`, `stream` and `return_type`.
+
+        Raises
+        ------
+        SplusError
+            If the job ended in error or was aborted.
+        """
+        job = self._job(job_id)
+        xmldoc = self._job_xml(job_id)
+        phase = _xml_text(xmldoc, 'phase')
+        if phase in _RUNNING_PHASES:
+            xmldoc = self.conn._wait_job(job["endpoint"] + job_id, phase)
+        phase = self._update(job_id, xmldoc)
+
+        if phase != 'COMPLETED':
+            raise SplusError(f"Job {job_id} is {phase}: {self._job(job_id)['error']}")
+
+        link = _result_link(xmldoc, self.conn.SERVER_IP)
+        res = self.conn._send('GET', link, stream=filename is not None or stream)
+        result = self.conn._load_result(res, filename, stream, return_type, None)
+
+        with self._db() as db:
+            db.execute("UPDATE jobs SET fetched = ? WHERE job_id = ?", (time.time(), job_id))
+        return result
+
+    def abort(self, job_id):
+        """Aborts a job on the server. Returns its new phase."""
+        job = self._job(job_id)
+        res = self.conn._send('POST', job["endpoint"] + job_id + "/phase", data={"PHASE": "ABORT"})
+        res.raise_for_status()
+        return self.phase(job_id)
+
+    def remove(self, job_id, delete=True):
+        """Forgets a job, deleting it on the server too if `delete` is set."""
+        job = self._job(job_id)
+        if delete:
+            self.conn._send('DELETE', job["endpoint"] + job_id)
+        with self._db() as db:
+            db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def list(self, phase=None):
+        """Recorded jobs (as dicts), the most recent first, optionally only those in a given phase."""
+        with self._db() as db:
+            if phase is None:
+                rows = db.execute("SELECT * FROM jobs ORDER BY submitted DESC").fetchall()
+            else:
+                rows = db.execute("SELECT * FROM jobs WHERE phase = ? ORDER BY submitted DESC", (phase,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def pending(self):
+        """Recorded jobs whose result was never fetched and that did not fail."""
+        return [job for job in self.list() if job["fetched"] is None and job["phase"] not in ('ERROR', 'ABORTED')]
+
+    def metrics(self, job_id):
+        """
+        Phase and timings of a job, as last recorded.
+
+        Returns
+        -------
+        dict
+            'phase', 'queued' (seconds between creation and start on the server), 'execution'
+            (seconds between start and end on the server), 'elapsed' (seconds since submission,
+            or until the result was fetched) and 'error'.
+        """
+        job = self._job(job_id)
+        end = job["fetched"] if job["fetched"] is not None else (job["updated"] if job["phase"] in _FINAL_PHASES else time.time())
+        return {
+            "phase": job["phase"],
+            "queued": _seconds_between(job["creation_time"], job["start_time"]),
+            "execution": _seconds_between(job["start_time"], job["end_time"]),
+            "elapsed": end - job["submitted"] if job["submitted"] is not None else None,
+            "error": job["error"],
+        }
+
+
+class _Registry:
+    """Opens the registry database for one transaction, rows readable by column name."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self._db = sqlite3.connect(self.path, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        return self._db
+
+    def __exit__(self, exc_type, exc, tb):
+        with closing(self._db):
+            if exc_type is None:
+                self._db.commit()
+            else:
+                self._db.rollback()